@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class SymmetricConfig(AppConfig):
+    name = 'symmetric'
+    verbose_name = 'Symmetric API'
+
+    def ready(self):
+        # Compile the API models at startup, so a pre-fork server shares them and the first requests aren't slower
+        if not getattr(settings, 'API_LAZY_MODELS', False):
+            from .functions import compile_api_models
+            compile_api_models()
@@ -5,3 +5,7 @@ class ApiException(Exception):
 
 class InsufficientRoleApiException(ApiException):
     pass
+
+
+class InvalidIncrementApiException(ApiException):
+    pass
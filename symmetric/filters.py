@@ -1,8 +1,10 @@
 from django.apps import apps
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q, QuerySet
 
-from .functions import sanitize_order_by, _get_api_model
+from .functions import camel_case_to_underscore, sanitize_order_by, _get_api_model
+from .translate import translate_expression
 from .response import set_response_headers
 
 
@@ -27,44 +29,140 @@ class SubclassQuerySet(QuerySet):
     def _clone(self, **kwargs):
         clone = super(SubclassQuerySet, self)._clone(**kwargs)
         clone._subclass_attrs = getattr(self, '_subclass_attrs', None)
+        clone._subclasses = getattr(self, '_subclasses', None)
+        clone._subclass_strategy = getattr(self, '_subclass_strategy', 'join')
+        clone._subclass_discriminator = getattr(self, '_subclass_discriminator', None)
         return clone
+    def _get_subclass_attr(self, obj):
+        """Return the subclass attr of an object from its discriminator, or None if it's not a known subclass."""
+        field, mapping = self._subclass_discriminator
+        return mapping.get(getattr(obj, field))
     def iterator(self):
+        if getattr(self, '_subclass_strategy', 'join') == 'prefetch':
+            for obj in self._prefetch_iterator():
+                yield obj
+            return
         iter = super(SubclassQuerySet, self).iterator()
+        discriminator = getattr(self, '_subclass_discriminator', None)
         for obj in iter:
             sub_obj = None
-            for attr in self._subclass_attrs:
-                if hasattr(obj, attr):
-                    sub_obj = getattr(obj, attr)
-                    break
+            if discriminator:
+                # The subclass is known, so only the one joined object is read
+                attr = self._get_subclass_attr(obj)
+                if attr:
+                    try:
+                        sub_obj = getattr(obj, attr)
+                    except ObjectDoesNotExist:
+                        pass
+            else:
+                for attr in self._subclass_attrs:
+                    if hasattr(obj, attr):
+                        sub_obj = getattr(obj, attr)
+                        break
             if sub_obj:
                 yield sub_obj
             else:
                 yield obj
+    def _prefetch_iterator(self):
+        """Fetch the base rows, then each subclass present with a single pk__in query."""
+        objs = list(super(SubclassQuerySet, self).iterator())
+        discriminator = getattr(self, '_subclass_discriminator', None)
+        if discriminator:
+            pks = {}
+            for obj in objs:
+                attr = self._get_subclass_attr(obj)
+                if attr:
+                    pks.setdefault(attr, []).append(obj.pk)
+        else:
+            # Without a discriminator, any subclass may be present
+            pks = dict((attr, [obj.pk for obj in objs]) for attr in self._subclass_attrs)
+        sub_objs = {}
+        for attr, subclass in zip(self._subclass_attrs, self._subclasses):
+            if pks.get(attr):
+                sub_objs.update(subclass._default_manager.using(self.db).in_bulk(pks[attr]))
+        for obj in objs:
+            yield sub_objs.get(obj.pk, obj)
 
 
 def subclass_filter(*subclasses, **names):
     """
     Convert the QuerySet to a SubclassQuerySet, where only the specified subclasses are returned and each object is cast to its subclass.
     The keyword arguments, has the names for the collection when generating files. name and name_plural provided as CamelCase are required.
+    The optional strategy keyword argument is either 'join' (default) to join every subclass table, or 'prefetch' to fetch the base rows
+    and then each subclass present with its own query. The optional discriminator keyword argument is a field name whose values are the
+    lowercase subclass names, or a tuple of the field name and a dict mapping its values to subclasses, so rows are cast without probing.
     """
     # TODO: To support multi-level inheritance, subclass_attrs needs find the common parent of all subclasses and will either be a dict tree of keys only (multi-level) or list (single).
     # The iterator() will then do multi-level getattr if isinstance(self._subclass_attrs, dict) otherwise use the existing code.
     # The select_related() part will also need to specify multi-level inheritance using intermediate__subclass strings
+    strategy = names.pop('strategy', 'join')
+    discriminator = names.pop('discriminator', None)
+    if strategy not in ('join', 'prefetch'):
+        raise ValueError('Unknown subclass_filter strategy: %s' % strategy)
     subclasses = list(subclasses)
     for i, subclass in enumerate(subclasses):
         if isinstance(subclass, (str, unicode)):
             subclass = subclass.split('.')
             subclasses[i] = get_model(subclass[0], subclass[1])
     subclass_attrs = [cls.__name__.lower() for cls in subclasses]
+    if discriminator:
+        if isinstance(discriminator, (str, unicode)):
+            discriminator = (discriminator, dict((attr, attr) for attr in subclass_attrs))
+        else:
+            field, mapping = discriminator
+            discriminator = (field, {})
+            for value, subclass in mapping.iteritems():
+                if isinstance(subclass, (str, unicode)):
+                    subclass = get_model(*subclass.split('.'))
+                discriminator[1][value] = subclass.__name__.lower()
     def subclass_filter_inner(request, queryset):
         set_response_headers(request, **{'X-Mixed-Results': True})
-        queryset = queryset._clone(SubclassQuerySet).select_related(*subclass_attrs)
+        queryset = queryset._clone(SubclassQuerySet)
+        if strategy == 'join':
+            queryset = queryset.select_related(*subclass_attrs)
         # Remember the subclass arguments, because the queryset.query.select_related dict may have other non-subclass attributes
         queryset._subclass_attrs = subclass_attrs
+        queryset._subclasses = subclasses
+        queryset._subclass_strategy = strategy
+        queryset._subclass_discriminator = discriminator
         return queryset
     return subclass_filter_inner
 
 
+_api_property_expressions = {}
+
+
+def get_api_property_expression(model, name):
+    """Return the database expression of an api_property, or None if it isn't an api_property or can't be translated."""
+    key = (model, name)
+    if not _api_property_expressions.has_key(key):
+        expression = None
+        attr = getattr(model, name, None)
+        if isinstance(attr, property) and attr.fget and hasattr(attr.fget, 'api_code'):
+            try:
+                expression = translate_expression(attr.fget.api_code, attr.fget.api_type)
+            except (ValueError, SyntaxError):
+                pass
+        _api_property_expressions[key] = expression
+    return _api_property_expressions[key]
+
+
+def annotate_api_property(queryset, name):
+    """Annotate the queryset with an api_property computed by the database. Returns the queryset and the name of the annotation."""
+    alias = '_' + name
+    if alias not in queryset.query.annotations:
+        queryset = queryset.annotate(**{alias: get_api_property_expression(queryset.model, name)})
+    return queryset, alias
+
+
+def _decode_api_property_value(api_type, value):
+    if api_type is bool:
+        return value.lower() in ('true', '1')
+    elif api_type in (int, long, float):
+        return api_type(value)
+    return value
+
+
 def search_filter(request, queryset):
     """Filter down the result by using a q query parameter. API.search_fields MUST be set to use this."""
     query = request.GET.get('q')
@@ -89,6 +187,16 @@ def field_filter(request, queryset):
             for field in queryset.model.API.filter_fields:
                 value = request.GET.get(field)
                 if value:
+                    name = camel_case_to_underscore(field) if getattr(settings, 'API_CAMELCASE', True) else field
+                    if not model.encoded_fields.has_key(field) and get_api_property_expression(queryset.model, name) is not None:
+                        # Filter on an api_property computed by the database
+                        try:
+                            value = _decode_api_property_value(getattr(queryset.model, name).fget.api_type, value)
+                        except ValueError:
+                            return queryset.none()
+                        queryset, alias = annotate_api_property(queryset, name)
+                        queryset = queryset.filter(**{alias: value})
+                        continue
                     encoded_field = model.encoded_fields[field]
                     key = encoded_field[0]
                     decode = encoded_field[3]
@@ -122,11 +230,15 @@ def order_by_filter(request, queryset):
     """Order the results by using an orderby parameter."""
     order_by = sanitize_order_by(request.GET.get('orderby', ''))
     if order_by:
+        name = order_by.lstrip('-')
         if hasattr(queryset.model, 'API') and hasattr(queryset.model.API, 'order_by_fields') and queryset.model.API.order_by_fields:
-            if order_by.lstrip('-') in queryset.model.API.order_by_fields:
-                queryset = queryset.order_by(order_by)
-        else:
-            queryset = queryset.order_by(order_by)
+            if name not in queryset.model.API.order_by_fields:
+                return queryset
+        if get_api_property_expression(queryset.model, name) is not None:
+            # Order by an api_property computed by the database
+            queryset, alias = annotate_api_property(queryset, name)
+            order_by = order_by[:-len(name)] + alias
+        queryset = queryset.order_by(order_by)
     return queryset
 
 
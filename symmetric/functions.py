@@ -1,8 +1,19 @@
+import codecs
 import datetime
+import json
+import logging
+import re
+import time
 
 from django.conf import settings
-from django.db import models
+from django.core import validators
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, empty
+
+from .exceptions import InvalidIncrementApiException
+from .rules import ApiFieldRule
 
 
 def underscore_to_camel_case(string):
@@ -30,51 +41,85 @@ def sanitize_order_by(string):
     return ''
 
 
+def _parse_int(iso, start, end):
+    value = iso[start:end]
+    if not value.isdigit():
+        raise ValueError('Invalid iso 8601 %s.' % iso)
+    return int(value)
+
+
+def _check_separators(iso, separators):
+    for index, separator in separators:
+        if iso[index] != separator:
+            raise ValueError('Invalid iso 8601 %s.' % iso)
+
+
+# Fixed offset timezones keyed by minutes, so they are only created once
+_fixed_timezones = {}
+
+
+def _get_fixed_timezone(minutes):
+    if not _fixed_timezones.has_key(minutes):
+        _fixed_timezones[minutes] = timezone.get_fixed_timezone(minutes)
+    return _fixed_timezones[minutes]
+
+
 def iso_8601_to_time(iso):
-    """Parse an iso 8601 date into a datetime.time."""
+    """Parse an iso 8601 date into a datetime.time, ignoring any fractional seconds."""
     if not iso:
         return None
-    return datetime.datetime.strptime(iso, '%H:%M:%S').time()
+    if len(iso) < 8 or (len(iso) > 8 and iso[8] != '.'):
+        raise ValueError('Invalid iso 8601 time %s.' % iso)
+    _check_separators(iso, ((2, ':'), (5, ':')))
+    return datetime.time(_parse_int(iso, 0, 2), _parse_int(iso, 3, 5), _parse_int(iso, 6, 8))
 
 
 def iso_8601_to_date(iso):
     """Parse an iso 8601 date into a datetime.date."""
     if not iso:
         return None
-    return datetime.datetime.strptime(iso[:10], '%Y-%m-%d').date()
+    if len(iso) < 10:
+        raise ValueError('Invalid iso 8601 date %s.' % iso)
+    _check_separators(iso, ((4, '-'), (7, '-')))
+    return datetime.date(_parse_int(iso, 0, 4), _parse_int(iso, 5, 7), _parse_int(iso, 8, 10))
 
 
 def iso_8601_to_datetime(iso):
     """Parse an iso 8601 string into a timezone aware datetime, ignoring and fractional seconds."""
     if not iso:
         return None
-    dt = datetime.datetime.strptime(iso[:19], '%Y-%m-%dT%H:%M:%S')
-    # strptime doesn't seem to handle timezones, parse them here
+    if len(iso) < 19:
+        raise ValueError('Invalid iso 8601 datetime %s.' % iso)
+    _check_separators(iso, ((4, '-'), (7, '-'), (10, 'T'), (13, ':'), (16, ':')))
+    args = (_parse_int(iso, 0, 4), _parse_int(iso, 5, 7), _parse_int(iso, 8, 10), _parse_int(iso, 11, 13), _parse_int(iso, 14, 16), _parse_int(iso, 17, 19))
     if len(iso) == 19:
-        return timezone.make_aware(dt, timezone.get_current_timezone())
+        return timezone.make_aware(datetime.datetime(*args), timezone.get_current_timezone())
     else:
         # Make the datetime UTC if Z is the timezone, ignoring fractional seconds in between
         if (len(iso) == 20 or iso[19] == '.') and iso[-1] == 'Z':
-            return timezone.make_aware(dt, timezone.UTC())
+            return datetime.datetime(*args, tzinfo=timezone.utc)
         # Parse a complete timezone e.g. +00:00, checking for the correct length or ignored fractional seconds
         if (len(iso) == 25 or iso[19] == '.') and iso[-6] in ('+', '-') and iso[-3] == ':':
             try:
-                hours = int(iso[-5:-3])
-                minutes = int(iso[-2:])
+                hours = _parse_int(iso, -5, -3)
+                minutes = _parse_int(iso, -2, len(iso))
+            except ValueError:
+                # drop through and raise the exception
+                pass
+            else:
                 minutes += hours * 60
                 if iso[-6] == '-':
                     minutes = -minutes
-                return timezone.make_aware(dt, timezone.get_fixed_timezone(minutes))
-            except:
-                # drop through and raise the exception
-                pass
+                return datetime.datetime(*args, tzinfo=_get_fixed_timezone(minutes))
         raise ValueError('Invalid timezone %s.' % iso[19:])
 
 
 def time_to_iso_8601(t):
     """Format a datetime.time as an iso 8601 string - HH:MM:SS."""
     if t:
-        return t.replace(microsecond=0).isoformat()
+        # Slice out any microseconds instead of creating a new time with replace()
+        iso = t.isoformat()
+        return iso[:8] + iso[15:] if t.microsecond else iso
     else:
         return None
 
@@ -90,11 +135,70 @@ def date_to_iso_8601(d):
 def datetime_to_iso_8601(dt):
     """Format a datetime as an iso 8601 string - YYYY-MM-DDTHH:MM:SS with optional timezone +HH:MM."""
     if dt:
-        return dt.replace(microsecond=0).isoformat()
+        # Slice out any microseconds instead of creating a new datetime with replace()
+        iso = dt.isoformat()
+        return iso[:19] + iso[26:] if dt.microsecond else iso
     else:
         return None
 
 
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_array(stream, chunk_size=65536):
+    """
+    Parse a JSON array from a file-like object of utf-8 bytes, such as a request, yielding each element as soon as it is read.
+    Only the elements being parsed are held in memory, instead of the whole body and the whole parsed array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = u''
+    index = 0
+    eof = False
+    # The next expected token is '[' at the start, a value or ']' after '[', a value after ',', and ',' or ']' after a value
+    expecting = '['
+    while True:
+        index = _JSON_WHITESPACE.match(buffer, index).end()
+        if index == len(buffer) and not eof:
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[index:] + text_decoder.decode(chunk, final=eof)
+            index = 0
+            continue
+        char = buffer[index:index + 1]
+        if expecting == '[':
+            if char != '[':
+                raise ValueError('Expecting a JSON array')
+            index += 1
+            expecting = 'first'
+        elif char == ']' and expecting in ('first', ','):
+            return
+        elif expecting == ',':
+            if char != ',':
+                raise ValueError('Expecting , or ] in the JSON array')
+            index += 1
+            expecting = 'value'
+        elif not char:
+            raise ValueError('Unterminated JSON array')
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, index)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # The value may be incomplete, or a number may be cut off at the end of the buffer, so read more first
+            if end is None or (end == len(buffer) and not eof):
+                chunk = stream.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[index:] + text_decoder.decode(chunk, final=eof)
+                index = 0
+                continue
+            yield value
+            index = end
+            expecting = ','
+
+
 def decode_int(value):
     """Decode an int after checking to make sure it is not already a int, 0.0, or empty."""
     if isinstance(value, (int, long)):
@@ -134,6 +238,93 @@ def decode_bool(value):
     return True
 
 
+class IdentityMap(object):
+    """A map of the objects loaded during a request keyed by model and primary key, to avoid fetching the same row twice."""
+
+    def __init__(self):
+        self._objects = {}
+
+    def get(self, model, pk):
+        """Return the loaded object or None."""
+        return self._objects.get((model, pk))
+
+    def add(self, obj):
+        """Add an object, such as request.user, unwrapping any lazy object, and return it."""
+        if isinstance(obj, SimpleLazyObject):
+            if obj._wrapped is empty:
+                obj._setup()
+            obj = obj._wrapped
+        if obj.pk is not None:
+            self._objects[(type(obj), obj.pk)] = obj
+        return obj
+
+    def remove(self, obj):
+        self._objects.pop((type(obj), obj.pk), None)
+
+
+def get_identity_map(request):
+    """Return the identity map of the request, creating it on first use."""
+    if not hasattr(request, 'api_identity_map'):
+        request.api_identity_map = IdentityMap()
+    return request.api_identity_map
+
+
+_INCREMENT_OPERATORS = {'$inc': 1, '$dec': -1}
+
+
+def decode_increment(value, decode):
+    """Decode an increment operation, e.g. {"$inc": 1} or {"$dec": 2}, into a signed amount using the decode function."""
+    if len(value) != 1:
+        raise ValueError('Exactly one increment operator is required.')
+    operator, amount = value.items()[0]
+    if not _INCREMENT_OPERATORS.has_key(operator):
+        raise ValueError('Invalid increment operator %s.' % operator)
+    amount = decode(amount)
+    if amount is None:
+        raise ValueError('Invalid increment amount.')
+    return amount * _INCREMENT_OPERATORS[operator]
+
+
+_RULE_VALIDATORS = {
+    'string': (('min', validators.MinLengthValidator), ('max', validators.MaxLengthValidator)),
+    'int': (('min', validators.MinValueValidator), ('max', validators.MaxValueValidator)),
+    'float': (('min', validators.MinValueValidator), ('max', validators.MaxValueValidator)),
+}
+
+
+def _compile_field_validator(field):
+    """
+    Compile the ApiFieldRule of a field into a function that validates a decoded value before any database work.
+    The field's own validators are used along with validators for any other rules, so errors are reported the same as full_clean.
+    """
+    rule = ApiFieldRule(field).rule
+    # The field's validators include the format and regex rules, and keep any custom messages
+    checks = list(field.validators)
+    classes = set(type(check) for check in checks)
+    for key, validator_class in _RULE_VALIDATORS.get(rule['type'], ()):
+        if rule.get(key) is not None and validator_class not in classes:
+            checks.append(validator_class(rule[key]))
+    required = rule.get('required', False)
+    def validate(value):
+        if value in field.empty_values:
+            if required:
+                code = 'null' if value is None and not field.null else 'blank'
+                raise ValidationError(field.error_messages[code], code=code)
+            return
+        # Convert the value the same as full_clean before the validators see it, e.g. '5.50' for a decimal field
+        value = field.to_python(value)
+        errors = []
+        for check in checks:
+            try:
+                check(value)
+            except ValidationError as e:
+                errors.extend(e.error_list)
+        if errors:
+            raise ValidationError(errors)
+    validate.field_name = field.name
+    return validate
+
+
 _api_models = {}
 
 
@@ -146,6 +337,10 @@ class _ApiModel(object):
         self.encoded_fields = {}
         self.id_field = None
         self.select_related_args = []
+        # Validation functions compiled from the field rules, keyed by encoded name
+        self.validators = {}
+        # Set to 'database' to skip the unique checks of full_clean and rely on the database's constraints instead
+        self.validate_unique = True
         # data dictionary, set fields instead of creating a new dictionary for each get_data
         self._data = {}
         self._list_data = {}
@@ -170,6 +365,8 @@ class _ApiModel(object):
                 update_fields = model.API.update_fields
             if hasattr(model.API, 'readonly_fields'):
                 readonly_fields = model.API.readonly_fields
+            if hasattr(model.API, 'validate_unique'):
+                self.validate_unique = model.API.validate_unique
 
         # Calculate all of the fields and list fields
         for field in model._meta.fields:
@@ -252,6 +449,8 @@ class _ApiModel(object):
                     pass
                 else:
                     self.encoded_fields[field_coding[1]] = field_coding
+                    if decode is not set_object_data:
+                        self.validators[field_coding[1]] = _compile_field_validator(field)
                 if list_fields is None or field.name in list_fields:
                     if field_coding[2] == get_object_data:
                         self.list_fields.append((field_coding[0], field_coding[1], get_object_list_data, field_coding[3]))
@@ -274,24 +473,74 @@ class _ApiModel(object):
                 self._data[encoded_name] = getattr(obj, name)
         return self._data
 
-    def set_data(self, obj, data):
+    def validate_data(self, data):
+        """Validate only the incoming values of data, raising a ValidationError in the same format as full_clean."""
+        errors = {}
+        for key, value in data.iteritems():
+            validate = self.validators.get(key)
+            # Increments are validated by the database
+            if validate and type(value) is not dict:
+                decode = self.encoded_fields[key][3]
+                try:
+                    validate(decode(value) if decode else value)
+                except ValidationError as e:
+                    errors[validate.field_name] = e.error_list
+        if errors:
+            raise ValidationError(errors)
+
+    def set_data(self, obj, data, validate=True):
+        if validate:
+            self.validate_data(data)
+        # Keep track of the changed fields, so that unchanged included objects aren't saved
+        if not hasattr(obj, '_changed_fields'):
+            obj._changed_fields = set()
         for key, value in data.iteritems():
             if self.encoded_fields.has_key(key):
                 name, encoded_name, encode, decode = self.encoded_fields[key]
                 if decode:
                     if decode is set_object_data:
                         decode(getattr(obj, name), value)
-                    else:
-                        setattr(obj, name, decode(value))
-                else:
+                        continue
+                    elif type(value) is dict and decode in (decode_int, decode_float):
+                        # A new object has no value to increment
+                        if obj._state.adding:
+                            raise InvalidIncrementApiException('Increments are only allowed when updating an object')
+                        # Atomically increment the field in the database when saved, remembering it to load the new value
+                        setattr(obj, name, models.F(name) + decode_increment(value, decode))
+                        obj._changed_fields.add(name)
+                        if not hasattr(obj, '_increment_data'):
+                            obj._increment_data = {}
+                        obj._increment_data[name] = encoded_name
+                        continue
+                    value = decode(value)
+                if getattr(obj, name) != value:
                     setattr(obj, name, value)
+                    obj._changed_fields.add(name)
 
 
 def _get_api_model(model):
-    key = model.__module__ + model.__name__
-    if not _api_models.has_key(key):
-        _api_models[key] = _ApiModel(model)
-    return _api_models[key]
+    api_model = _api_models.get(model)
+    if api_model is None:
+        api_model = _api_models[model] = _ApiModel(model)
+    return api_model
+
+
+def compile_api_models(models=None):
+    """
+    Compile the API models, by default all installed models with an API class, instead of lazily on first use.
+    Logs and returns the compilation time in seconds of each model.
+    """
+    if models is None:
+        from django.apps import apps
+        models = [model for model in apps.get_models() if hasattr(model, 'API')]
+    logger = logging.getLogger('symmetric')
+    timings = {}
+    for model in models:
+        start = time.time()
+        _get_api_model(model)
+        timings[model] = time.time() - start
+        logger.info('Compiled API model %s.%s in %.2fms', model._meta.app_label, model.__name__, timings[model] * 1000)
+    return timings
 
 
 def get_object_list_data(obj):
@@ -314,12 +563,38 @@ def get_object_data(obj):
     return data
 
 
-def set_object_data(obj, data):
+def decode_natural_key(model, data, natural_key):
+    """Decode the values of the natural key fields in data into a lookup dict, raising a KeyError if any are missing."""
+    api_model = _get_api_model(model)
+    lookup = {}
+    for field_name in natural_key:
+        for name, encoded_name, encode, decode in api_model.fields + api_model.encoded_fields.values():
+            if decode is not set_object_data and (name == field_name or name == field_name + '_id'):
+                value = data[encoded_name]
+                lookup[name] = decode(value) if decode else value
+                break
+        else:
+            raise KeyError(field_name)
+    return lookup
+
+
+def set_object_data(obj, data, validate=True):
     model = _get_api_model(type(obj))
-    model.set_data(obj, data)
+    model.set_data(obj, data, validate)
+
+
+def validate_object_data(model, data):
+    """Validate the data for a model, so that invalid data can be rejected before fetching any objects."""
+    _get_api_model(model).validate_data(data)
 
 
 def save_object(obj):
+    """Clean and save the object along with any changed included objects, all within a single transaction."""
+    with transaction.atomic():
+        _save_object(obj)
+
+
+def _save_object(obj, included=False):
     model = type(obj)
     if hasattr(model, 'API') and hasattr(model.API, 'include_related'):
         for field in model.API.include_related:
@@ -329,6 +604,107 @@ def save_object(obj):
                 continue
             subobj = getattr(obj, field, None)
             if subobj:
-                save_object(subobj)
-    obj.full_clean()
-    obj.save()
+                _save_object(subobj, True)
+    update_fields = None
+    if included:
+        # Only save the changed fields of an included object, and nothing at all if set_object_data didn't change it
+        changed_fields = getattr(obj, '_changed_fields', None)
+        if not changed_fields:
+            return
+        if obj.pk is not None:
+            update_fields = set(changed_fields)
+            for field in model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False):
+                    update_fields.add(field.attname)
+    increments = getattr(obj, '_increment_data', None)
+    if increments:
+        # Incremented fields hold F() expressions until saved, so skip their validation and reload them afterwards, in
+        # save_object's transaction so that the row is still locked by the UPDATE
+        _clean_and_save(obj, increments.keys(), update_fields)
+        obj.refresh_from_db(fields=increments.keys())
+    else:
+        _clean_and_save(obj, None, update_fields)
+    obj._changed_fields = set()
+
+
+def _clean_and_save(obj, exclude=None, update_fields=None):
+    if _get_api_model(type(obj)).validate_unique == 'database':
+        obj.full_clean(exclude=exclude, validate_unique=False)
+        try:
+            with transaction.atomic():
+                obj.save(update_fields=update_fields)
+        except IntegrityError:
+            # Only when a constraint fails, run the unique checks to raise the same error that full_clean would have
+            obj.validate_unique(exclude=exclude)
+            raise
+    else:
+        obj.full_clean(exclude=exclude)
+        obj.save(update_fields=update_fields)
+
+
+def get_object_increment_data(obj):
+    """Return a dict of the saved values of all incremented fields keyed by their encoded names."""
+    increments = getattr(obj, '_increment_data', {})
+    return dict((encoded_name, getattr(obj, name)) for name, encoded_name in increments.iteritems())
+
+
+def update_object_data(queryset, data, **values):
+    """
+    Decode data and update all objects in queryset with a single UPDATE query, bypassing the model's save method.
+
+    Each decoded field is cleaned individually, auto_now fields are refreshed, and any extra values are set as is.
+    Returns a tuple of the number of rows updated and a dict of the new values of any incremented fields keyed by
+    their encoded names, or (None, None) if the data includes a related object that requires save_object.
+    """
+    model = queryset.model
+    api_model = _get_api_model(model)
+    fields = dict((field.attname, field) for field in model._meta.concrete_fields)
+    instance = model()
+    decoded = {}
+    increments = {}
+    increment_names = {}
+    for key, value in data.iteritems():
+        if api_model.encoded_fields.has_key(key):
+            name, encoded_name, encode, decode = api_model.encoded_fields[key]
+            if decode is set_object_data:
+                return None, None
+            elif type(value) is dict and decode in (decode_int, decode_float):
+                increments[name] = models.F(name) + decode_increment(value, decode)
+                increment_names[name] = encoded_name
+            else:
+                decoded[name] = decode(value) if decode else value
+    errors = {}
+    for name, value in decoded.iteritems():
+        field = fields[name]
+        # Skip validation for empty fields with blank=True, the same as Model.clean_fields
+        if field.blank and value in field.empty_values:
+            continue
+        try:
+            decoded[name] = field.clean(value, instance)
+        except ValidationError as e:
+            errors[field.name] = e.error_list
+    if errors:
+        raise ValidationError(errors)
+    for field in fields.itervalues():
+        if getattr(field, 'auto_now', False):
+            decoded[field.attname] = field.pre_save(instance, False)
+    decoded.update(increments)
+    decoded.update(values)
+    if not decoded:
+        # Nothing to update, but still report if the object exists
+        return queryset.count(), {}
+    if not increments:
+        return queryset.update(**decoded), {}
+    # Load the new values computed by the database in the same transaction, with the rows locked, so that another
+    # request's increment can't be read instead. They're loaded by pk, since the update may change the fields that the
+    # queryset is filtered by.
+    with transaction.atomic():
+        pks = list(queryset.select_for_update().values_list('pk', flat=True))
+        if not pks:
+            return 0, {}
+        count = queryset.update(**decoded)
+        names = increments.keys()
+        new_values = model._default_manager.filter(pk__in=pks).order_by('pk').values_list(*names).first()
+        if new_values:
+            return count, dict((increment_names[name], value) for name, value in zip(names, new_values))
+    return count, {}
@@ -86,6 +86,8 @@ class Command(BaseCommand):
             requirements.append('READ requests may be anonymous.')
         if view.requirements & ApiRequirement.HTTPS:
             requirements.append('Request must be done over HTTPS.')
+        if view.requirements & ApiRequirement.TOKEN:
+            requirements.append('User may be identified by an X-Api-Token header.')
         return ' '.join(requirements)
 
     def help_text(self, field_name, view):
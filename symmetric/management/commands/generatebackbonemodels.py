@@ -18,8 +18,8 @@ from symmetric.functions import camel_case_to_underscore, underscore_to_camel_ca
 from symmetric.management.codeemitter import CodeEmitter
 from symmetric.management.functions import get_base_classes, get_resource_type, get_subclass_filter, format_regex_stack, is_readonly, is_excluded, is_included
 from symmetric.management.functions import get_model_name, get_model_name_plural, get_collection_name, get_collection_name_plural
-from symmetric.management.rules import ApiFieldRule
-from symmetric.management.translate import translate_code
+from symmetric.rules import ApiFieldRule
+from symmetric.translate import translate_code
 from symmetric.models import get_related_model
 from symmetric.views import ApiAction, ApiRequirement, BasicApiView, api_view
 
@@ -259,7 +259,7 @@ class Command(BaseCommand):
         for cls in [model] + get_base_classes(model):
             for name in cls.__dict__:
                 attr = cls.__dict__[name]
-                if type(attr) is property and attr.fget and hasattr(attr.fget, 'api_code'):
+                if isinstance(attr, property) and attr.fget and hasattr(attr.fget, 'api_code'):
                     if self.camelcase:
                         name = underscore_to_camel_case(name)
                     if getattr(attr.fget, 'api_translations', None) and attr.fget.api_translations.has_key(lang):
@@ -5,7 +5,7 @@ from django.core.management.base import BaseCommand
 from django.template import Template
 
 from symmetric.management.generatemodels import GenerateModelsCommand
-from symmetric.management.translate import data_to_objc
+from symmetric.translate import data_to_objc
 
 
 included_field_setter = """{% if included %}- (void)set{{ name|title }}:({{ included_name }} *)new{{ name|title }} {
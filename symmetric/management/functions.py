@@ -36,7 +36,7 @@ def get_api_properties(model):
     for cls in [model] + list(model._meta.get_parent_list()):
         for field_name in cls.__dict__:
             attr = cls.__dict__[field_name]
-            if type(attr) is property and attr.fget and hasattr(attr.fget, 'api_code'):
+            if isinstance(attr, property) and attr.fget and hasattr(attr.fget, 'api_code'):
                 properties[field_name] = attr
     return properties
 
@@ -70,12 +70,22 @@ def get_app_url_prefix(app_name, app_patterns):
     from django.conf import settings
     module_name = app_name.lower() + '.urls'
     module = import_module(settings.ROOT_URLCONF)
-    for urlpattern in module.urlpatterns:
+    return _find_url_prefix(module.urlpatterns, module_name, app_patterns)
+
+
+def _find_url_prefix(urlpatterns, module_name, app_patterns):
+    from symmetric.urls import ApiURLResolver
+    for urlpattern in urlpatterns:
         # A RegexURLResolver object will have a _urlconf_module attribute that is either a module or a RegexURLPattern list matched up with the app_name or app_patterns
         if hasattr(urlpattern, '_urlconf_module'):
             if isinstance(urlpattern._urlconf_module, list):
                 if urlpattern._urlconf_module is app_patterns:
                     return urlpattern._regex
+                elif isinstance(urlpattern, ApiURLResolver):
+                    # The patterns from api_patterns are nested under a single /api/ resolver
+                    prefix = _find_url_prefix(urlpattern._urlconf_module, module_name, app_patterns)
+                    if prefix:
+                        return urlpattern._regex + prefix.lstrip('^')
             elif getattr(urlpattern._urlconf_module, '__name__', '').lower() == module_name:
                 return urlpattern._regex
     return ''
@@ -12,7 +12,7 @@ from django.template import Template, Context
 import symmetric.management.overrides
 from symmetric.functions import _ApiModel, underscore_to_camel_case
 from symmetric.management.functions import get_base_classes, get_base_models, get_base_model, get_field, has_field
-from symmetric.management.translate import translate_code
+from symmetric.translate import translate_code
 from symmetric.models import get_related_model
 from symmetric.views import ApiAction, ApiRequirement, BasicApiView, api_view
 
@@ -167,7 +167,7 @@ class GenerateModelsCommand(object):
             property_transformer = getattr(self, 'property_transformer', None)
             for name in model.__dict__:
                 attr = model.__dict__[name]
-                if type(attr) is property and attr.fget and hasattr(attr.fget, 'api_code'):
+                if isinstance(attr, property) and attr.fget and hasattr(attr.fget, 'api_code'):
                     if getattr(attr.fget, 'api_translations', None) and attr.fget.api_translations.has_key(self.lang):
                         code = attr.fget.api_translations[self.lang]
                     else:
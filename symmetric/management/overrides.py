@@ -16,7 +16,7 @@ This file must be imported before accessing any of the views getting overridden!
 
 class _api_view(object):
 
-    def __init__(self, model, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None):
+    def __init__(self, model, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None, pushdown=False, cors=None, cache_control=None):
         if isinstance(model, (str, unicode)):
             model = model.split('.')
             self.model = get_model(model[0], model[1])
@@ -27,6 +27,9 @@ class _api_view(object):
         self.filter = filter
         self.authorization = authorization
         self.verification = verification
+        self.pushdown = pushdown
+        self.cors = cors
+        self.cache_control = cache_control
 
     def __call__(self):
         # Empty call so that django will accept is as a view
@@ -36,6 +39,8 @@ class _api_view(object):
 class _subclass_filter(object):
 
     def __init__(self, *subclasses, **names):
+        self.strategy = names.pop('strategy', 'join')
+        self.discriminator = names.pop('discriminator', None)
         subclasses = list(subclasses)
         for i, subclass in enumerate(subclasses):
             if isinstance(subclass, (str, unicode)):
@@ -66,7 +71,7 @@ class _combine_filters(object):
 
 class _api_related_view(_api_view):
 
-    def __init__(self, model, related_model, related_field, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None):
+    def __init__(self, model, related_model, related_field, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None, cors=None, cache_control=None):
         if isinstance(model, (str, unicode)):
             model = model.split('.')
             self.parent_model = get_model(model[0], model[1])
@@ -80,7 +85,7 @@ class _api_related_view(_api_view):
             filter = _combine_filters(related_view_filter, filter)
         else:
             filter = related_view_filter
-        super(_api_related_view, self).__init__(related_model, actions, requirements, filter, authorization, verification)
+        super(_api_related_view, self).__init__(related_model, actions, requirements, filter, authorization, verification, cors=cors, cache_control=cache_control)
 
     def __call__(self):
         # Empty call so that django will accept is as a view
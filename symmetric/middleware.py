@@ -1,13 +1,38 @@
 import json
+import zlib
+from io import BytesIO
 
 from django.conf import settings
-from django.http import HttpRequest, QueryDict
+from django.core.urlresolvers import Resolver404, resolve
+from django.http import HttpRequest, HttpResponse, QueryDict
 from django.utils.datastructures import MultiValueDict
+from django.utils.functional import SimpleLazyObject, empty
 
+from symmetric.functions import iter_json_array
+from symmetric.purge import defer_purges, flush_purges
 from symmetric.response import render_error
+from symmetric.urls import get_latest_version
 from symmetric.views import ApiAction
 
 
+class _PrefixedStream(object):
+    """A stream that reads bytes that were already read from another stream before reading the rest of it."""
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=None):
+        if size is None:
+            data = self.prefix + self.stream.read()
+            self.prefix = b''
+            return data
+        if self.prefix:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+            return data
+        return self.stream.read(size)
+
+
 class ApiMiddleware(object):
     """
     Api middleware. If this is enabled, each request object will
@@ -17,6 +42,9 @@ class ApiMiddleware(object):
     api_json (True/False/String) - depending on the ?json part of the url request
     api_callback (String) - sets request.api_json = callback and request.api_callback = True and is meant render json wrapped in a callback
     api_version (int) - if api is True, 1 by default, > 1 if /api/#/ is given
+    api_data (dict) - if api is True, the parsed JSON body, or request.POST or request.PUT for other content types, or a generator of
+        the elements of a large JSON array for views marked with stream_json
+    api_cors_origin (String) - if api is True, the origin allowed by the view's CORS settings, '' if not allowed, or None if CORS is disabled
     NOTE: request.api_callback is only/always set if request.api_json = True and request.api_json is only/always set if request.api = True
     If requested with AJAX or Accept header wants json, then json is always used.
     """
@@ -31,12 +59,154 @@ class ApiMiddleware(object):
     }
     _API_JSONP = getattr(settings, 'API_JSONP', False)
     _API_CSRF = getattr(settings, 'API_CSRF', True)
+    _API_STRIP_VERSION = getattr(settings, 'API_STRIP_VERSION', False)
+    _API_MAX_BODY_SIZE = getattr(settings, 'API_MAX_BODY_SIZE', None)
+    _API_STREAM_JSON_SIZE = getattr(settings, 'API_STREAM_JSON_SIZE', None)
     _ERROR_JSONP = 'JSONP requests are not allowed'
+    _ERROR_VERSION = 'Api version not found'
+    _API_MAX_DECOMPRESSED_SIZE = getattr(settings, 'API_MAX_DECOMPRESSED_SIZE', 10 * 1024 * 1024)
+    _ERROR_BODY_SIZE = 'The request body is too large'
+    _ERROR_CONTENT_ENCODING = 'Unsupported Content-Encoding'
+    _ERROR_DECOMPRESSION = 'Invalid compressed request body'
+    _CHUNK_SIZE = 64 * 1024
+    _API_CORS_ORIGINS = getattr(settings, 'API_CORS_ORIGINS', None)
+    _API_CORS_HEADERS = getattr(settings, 'API_CORS_HEADERS', ('Accept', 'Content-Type', 'Content-Encoding', 'X-Requested-With', 'X-CSRFToken', 'X-Hmac', 'X-Native-App', 'X-Api-Token'))
+    _API_CORS_MAX_AGE = getattr(settings, 'API_CORS_MAX_AGE', 86400)
+    _API_CORS_CREDENTIALS = getattr(settings, 'API_CORS_CREDENTIALS', False)
+    _CORS_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+    @staticmethod
+    def _get_query_dict(data):
+        query_dict = QueryDict('', mutable=True)
+        # Arrays, streamed or not, have no fields to copy
+        if isinstance(data, dict):
+            query_dict.update(data)
+        return query_dict
+
+    @staticmethod
+    def _peek_array(request):
+        """Return True if the body is a JSON array, leaving the body to be read again from the start."""
+        head = b''
+        while not head.strip():
+            chunk = request.read(ApiMiddleware._CHUNK_SIZE)
+            if not chunk:
+                break
+            head += chunk
+        request._stream = _PrefixedStream(head, request._stream)
+        request._read_started = False
+        return head.lstrip()[:1] == b'['
+
+    @staticmethod
+    def _read_body(request):
+        """
+        Read the body chunk by chunk, returning None if it's larger than the maximum body size, regardless of the
+        Content-Length, which a chunked body may not have.
+        """
+        if not hasattr(request, '_body'):
+            max_size = ApiMiddleware._API_MAX_BODY_SIZE
+            parts = []
+            size = 0
+            for chunk in iter(lambda: request.read(ApiMiddleware._CHUNK_SIZE), b''):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    return None
+                parts.append(chunk)
+            request._body = b''.join(parts)
+            request._stream = BytesIO(request._body)
+            request._read_started = False
+        return request._body
+
+    @staticmethod
+    def _decompress(request, encoding):
+        """
+        Decompress the request body chunk by chunk, returning None if it's larger than the maximum body size before
+        decompressing it or the maximum decompressed size after.
+        """
+        max_body_size = ApiMiddleware._API_MAX_BODY_SIZE
+        max_size = ApiMiddleware._API_MAX_DECOMPRESSED_SIZE
+        decompressor = None
+        parts = []
+        body_size = 0
+        size = 0
+        for chunk in iter(lambda: request.read(ApiMiddleware._CHUNK_SIZE), b''):
+            body_size += len(chunk)
+            if max_body_size and body_size > max_body_size:
+                return None
+            if decompressor is None:
+                if encoding == 'deflate' and not (len(chunk) >= 2 and ord(chunk[0]) & 0x0f == 8 and (ord(chunk[0]) * 256 + ord(chunk[1])) % 31 == 0):
+                    # Some clients send a raw deflate stream without the zlib header
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                else:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS if encoding in ('gzip', 'x-gzip') else zlib.MAX_WBITS)
+            # Limit the output of each step, so a small compressed chunk can't expand beyond the maximum size in memory
+            while chunk:
+                part = decompressor.decompress(chunk, max_size - size + 1 if max_size else 0)
+                size += len(part)
+                if max_size and size > max_size:
+                    return None
+                parts.append(part)
+                chunk = decompressor.unconsumed_tail
+        if decompressor is not None:
+            parts.append(decompressor.flush())
+        return b''.join(parts)
+
+    @staticmethod
+    def _get_cors_origin(request, view):
+        """Return the origin allowed by the view's cors setting or the global one, '' if it isn't allowed, or None if CORS is disabled."""
+        origins = getattr(view, 'cors', None)
+        if origins is None:
+            origins = ApiMiddleware._API_CORS_ORIGINS
+        if not origins:
+            return None
+        if isinstance(origins, basestring):
+            origins = (origins,)
+        origin = request.META.get('HTTP_ORIGIN', '')
+        if '*' in origins:
+            # Any origin is allowed without credentials, echoing the origin to allow credentials would let any site make
+            # authenticated requests
+            return '*'
+        return origin if origin in origins else ''
+
+    @staticmethod
+    def _get_cors_methods(view):
+        """Return the methods allowed by the view's actions, or all of them if the view doesn't have any actions."""
+        actions = getattr(view, 'actions', None)
+        if actions is None:
+            return ApiMiddleware._CORS_METHODS
+        if actions & ApiAction.UPSERT:
+            actions |= ApiAction.UPDATE
+        return tuple(method for method in ApiMiddleware._CORS_METHODS if ApiMiddleware._METHOD_ACTION_DICT[method] & actions)
+
+    @staticmethod
+    def _preflight(request):
+        """Answer a CORS preflight request without running the view or any other middleware, None if there isn't a view."""
+        try:
+            view = resolve(request.path_info, getattr(request, 'urlconf', None)).func
+        except Resolver404:
+            return None
+        response = HttpResponse()
+        origin = ApiMiddleware._get_cors_origin(request, view)
+        if origin is None:
+            return None
+        if origin != '*':
+            response['Vary'] = 'Origin'
+        if origin:
+            response['Access-Control-Allow-Origin'] = origin
+            response['Access-Control-Allow-Methods'] = ', '.join(ApiMiddleware._get_cors_methods(view))
+            response['Access-Control-Allow-Headers'] = ', '.join(ApiMiddleware._API_CORS_HEADERS)
+            response['Access-Control-Max-Age'] = str(ApiMiddleware._API_CORS_MAX_AGE)
+            # Credentials can only be allowed for a specific origin
+            if ApiMiddleware._API_CORS_CREDENTIALS and origin != '*':
+                response['Access-Control-Allow-Credentials'] = 'true'
+        return response
 
     def process_request(self, request):
+        # Purge the objects saved during the request once it's finished, after the transaction has committed
+        defer_purges()
         if request.path.startswith('/api/'):
             request.api = True
             request.api_version = 1
+            request.api_cors_origin = None
             request.api_action = ApiMiddleware._METHOD_ACTION_DICT.get(request.method, ApiAction._UNKNOWN)
             if request.is_ajax() or request.META.get('HTTP_ACCEPT', '').startswith('application/json'):
                 request.api_json = True
@@ -64,28 +234,98 @@ class ApiMiddleware(object):
             components = request.path.split('/', 3)
             if len(components) >= 3 and components[2].isdigit():
                 request.api_version = int(components[2])
+                if ApiMiddleware._API_STRIP_VERSION:
+                    # Resolve every version with the same patterns by removing the version from the path
+                    version_prefix = '/api/%s/' % components[2]
+                    if request.path_info.startswith(version_prefix):
+                        request.path_info = '/api/' + request.path_info[len(version_prefix):]
+                        request._api_version_stripped = True
+
+            # Answer CORS preflight requests before anything else
+            if request.method == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in request.META:
+                response = ApiMiddleware._preflight(request)
+                if response is not None:
+                    return response
+
+            # Check the size of the body before reading it
+            try:
+                content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                content_length = 0
+            if ApiMiddleware._API_MAX_BODY_SIZE and content_length > ApiMiddleware._API_MAX_BODY_SIZE:
+                return render_error(request, ApiMiddleware._ERROR_BODY_SIZE, 413)
 
-            # Process JSON data and PUT requests
+            # Decompress the body, everything else including the HMAC check then uses the decompressed body
+            encoding = request.META.get('HTTP_CONTENT_ENCODING', 'identity').strip().lower()
+            if encoding != 'identity':
+                if encoding not in ('gzip', 'x-gzip', 'deflate'):
+                    return render_error(request, ApiMiddleware._ERROR_CONTENT_ENCODING, 415)
+                try:
+                    body = ApiMiddleware._decompress(request, encoding)
+                except zlib.error:
+                    return render_error(request, ApiMiddleware._ERROR_DECOMPRESSION, 400)
+                if body is None:
+                    return render_error(request, ApiMiddleware._ERROR_BODY_SIZE, 413)
+                request._body = body
+                request._stream = BytesIO(body)
+                request._read_started = False
+                content_length = len(body)
+                request.META['CONTENT_LENGTH'] = str(content_length)
+
+            # Process JSON data, and PUT and PATCH requests
+            request.api_data = {}
             if request.META.get('CONTENT_TYPE', '').startswith('application/json'):
-                # Should set either request.POST or request.PUT
-                query_dict = QueryDict('', mutable=True)
-                query_dict.update(json.loads(request.body))
-                setattr(request, request.method, query_dict)
+                if ApiMiddleware._API_STREAM_JSON_SIZE and content_length > ApiMiddleware._API_STREAM_JSON_SIZE and ApiMiddleware._peek_array(request):
+                    # A large array is parsed as it's iterated if the view accepts a stream (see process_view),
+                    # otherwise it's parsed when it's first used
+                    request._api_stream_json = True
+                    request.api_data = SimpleLazyObject(lambda: json.loads(request.body))
+                else:
+                    body = ApiMiddleware._read_body(request)
+                    if body is None:
+                        return render_error(request, ApiMiddleware._ERROR_BODY_SIZE, 413)
+                    request.api_data = json.loads(body)
+                # Should set either request.POST or request.PUT, but only copy the data into a QueryDict if it's used
+                setattr(request, request.method, SimpleLazyObject(lambda: ApiMiddleware._get_query_dict(request.api_data)))
                 if request.method == 'PATCH':
                     request.PUT = request.PATCH
                 request._files = MultiValueDict()
-            elif request.method == 'PUT':
-                # Process PUT requests
+            elif request.method == 'POST':
+                request.api_data = SimpleLazyObject(lambda: request.POST)
+            elif request.method in ('PUT', 'PATCH'):
+                # Process PUT and PATCH requests
                 if hasattr(request, '_post'):
                     del request._post
                     del request._files
+                method = request.method
                 request.method = 'POST'
                 request._load_post_and_files()
-                request.method = 'PUT'
+                request.method = method
                 request.PUT = request.POST
+                if method == 'PATCH':
+                    request.PATCH = request.PUT
+                request.api_data = request.PUT
 
             # Skip the csrf check (see Django's CsrfViewMiddleware)
             if not ApiMiddleware._API_CSRF and (request.is_ajax() or request.META.has_key('HTTP_X_NATIVE_APP')):
                 request.csrf_processing_done = True
         else:
             request.api = False
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # A stripped version resolves with the same patterns as every other version, so check it's one of the versions
+        # given to api_patterns, now that the urlconf has been loaded
+        if request.api and getattr(request, '_api_version_stripped', False):
+            latest_version = get_latest_version(request.path_info)
+            if latest_version is not None and not 1 <= request.api_version <= latest_version:
+                return render_error(request, ApiMiddleware._ERROR_VERSION, 404)
+        if request.api and getattr(request, '_api_stream_json', False) and getattr(view_func, 'stream_json', False) and request.api_data._wrapped is empty:
+            request.api_data = iter_json_array(request)
+        # Actual cross-origin requests get the CORS headers in apply_response_headers
+        if request.api and 'HTTP_ORIGIN' in request.META:
+            request.api_cors_origin = ApiMiddleware._get_cors_origin(request, view_func)
+
+    def process_response(self, request, response):
+        # ATOMIC_REQUESTS has committed by now, and the view's own atomic blocks have finished
+        flush_purges()
+        return response
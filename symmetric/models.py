@@ -1,11 +1,50 @@
+def _clear_api_property_cache(sender, instance, **kwargs):
+    instance.__dict__.pop('_api_property_cache', None)
 
-def api_property(code, return_type=int, translations=None):
-    def api_property_fun(self):
-        return eval(code)
+
+def _connect_api_property_cache(model):
+    from django.db.models.signals import post_save
+    # The dispatch_uid makes connecting the same model again a no-op
+    post_save.connect(_clear_api_property_cache, sender=model, weak=False, dispatch_uid='symmetric.models.api_property')
+
+
+def _connect_inherited_api_property_cache(sender, **kwargs):
+    # An instance of a subclass is saved as the subclass, so a model that inherits a cached property needs its own receiver
+    for cls in sender.__mro__[1:]:
+        if any(isinstance(attr, _CachedApiProperty) for attr in cls.__dict__.itervalues()):
+            _connect_api_property_cache(sender)
+            break
+
+
+class _CachedApiProperty(property):
+    """A cached api_property, that clears the cache of its model's instances when they're saved."""
+
+    def contribute_to_class(self, cls, name):
+        setattr(cls, name, self)
+        _connect_api_property_cache(cls)
+
+
+def api_property(code, return_type=int, translations=None, cached=False):
+    """
+    Create a property from the code of a python expression using self, that can also be translated for generated models.
+    The code is compiled once, and when cached is True the value is memoized per instance until the instance is saved.
+    """
+    fun = eval(compile('lambda self: (\n%s\n)' % code, '<api_property>', 'eval'), globals())
+    if cached:
+        from django.db.models.signals import class_prepared
+        class_prepared.connect(_connect_inherited_api_property_cache, weak=False, dispatch_uid='symmetric.models.api_property')
+        def api_property_fun(self):
+            cache = self.__dict__.setdefault('_api_property_cache', {})
+            if api_property_fun not in cache:
+                cache[api_property_fun] = fun(self)
+            return cache[api_property_fun]
+    else:
+        api_property_fun = fun
     api_property_fun.api_code = code
     api_property_fun.api_type = return_type
     api_property_fun.api_translations = translations
-    return property(api_property_fun)
+    api_property_fun.api_cached = cached
+    return _CachedApiProperty(api_property_fun) if cached else property(api_property_fun)
 
 
 def create_model(name, fields):
@@ -26,8 +65,9 @@ def clone_model(model, name):
     for cls in [model] + list(model._meta.get_parent_list()):
         for field_name in cls.__dict__:
             attr = cls.__dict__[field_name]
-            if type(attr) is property and attr.fget and hasattr(attr.fget, 'api_code'):
-                fields[field_name] = api_property(attr.fget.api_code, attr.fget.api_type, attr.fget.api_translations)
+            if isinstance(attr, property) and attr.fget and hasattr(attr.fget, 'api_code'):
+                # The getter is already compiled, so share it
+                fields[field_name] = type(attr)(attr.fget)
     return type(name, model.__bases__, fields)
 
 
@@ -0,0 +1,111 @@
+import logging
+import threading
+import urllib2
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('symmetric')
+
+_purgers = {}
+_local = threading.local()
+
+
+def get_surrogate_key(model, object_id=None):
+    """The surrogate key of a model, or of one of its objects if an id is given."""
+    key = '%s.%s' % (model._meta.app_label, model._meta.model_name)
+    if object_id is not None:
+        key += '.%s' % object_id
+    return key
+
+
+class BasePurger(object):
+    """Invalidates the cached api responses tagged with any of the surrogate keys, this base purger purges nothing."""
+
+    def purge(self, keys):
+        pass
+
+
+class HttpPurger(BasePurger):
+    """
+    Sends a PURGE request with the keys in a Surrogate-Key header to API_PURGE_URL, e.g. a local Varnish or other
+    reverse proxy configured to ban the tagged responses.
+    """
+
+    def __init__(self, url=None, timeout=None):
+        self.url = url or getattr(settings, 'API_PURGE_URL', 'http://127.0.0.1:6081/')
+        self.timeout = timeout or getattr(settings, 'API_PURGE_TIMEOUT', 2)
+
+    def purge(self, keys):
+        request = urllib2.Request(self.url, headers={'Surrogate-Key': ' '.join(keys)})
+        request.get_method = lambda: 'PURGE'
+        try:
+            urllib2.urlopen(request, timeout=self.timeout).close()
+        except Exception as e:
+            # A write shouldn't fail because the cache couldn't be reached, the responses will expire anyway
+            logger.warning('Failed to purge %s: %s', ' '.join(keys), e)
+
+
+class MemoryPurger(BasePurger):
+    """Records the purged keys, for tests."""
+
+    def __init__(self):
+        self.purged = []
+
+    def purge(self, keys):
+        self.purged.append(keys)
+
+
+def get_purger():
+    """The purger instance of the API_PURGER setting, or None if there isn't one."""
+    path = getattr(settings, 'API_PURGER', None)
+    if not path:
+        return None
+    if path not in _purgers:
+        _purgers[path] = import_string(path)()
+    return _purgers[path]
+
+
+def defer_purges():
+    """Collect the keys purged in this thread until flush_purges, e.g. until a request's transaction has committed."""
+    _local.keys = []
+
+
+def flush_purges():
+    """Purge the keys collected since defer_purges, and stop collecting them."""
+    keys = getattr(_local, 'keys', None)
+    _local.keys = None
+    if keys:
+        purger = get_purger()
+        if purger is not None:
+            purger.purge(keys)
+
+
+def purge(model, object_id=None):
+    """
+    Purge the collections of a model, and an object's responses if an id is given. The keys are purged when the request
+    finishes if the purges are deferred, so a response can't be cached again from data that isn't committed yet.
+    """
+    purger = get_purger()
+    if purger is not None:
+        keys = [get_surrogate_key(model)]
+        if object_id is not None:
+            keys.append(get_surrogate_key(model, object_id))
+        deferred = getattr(_local, 'keys', None)
+        if deferred is None:
+            purger.purge(keys)
+        else:
+            deferred.extend(key for key in keys if key not in deferred)
+
+
+def purge_object(sender, instance, **kwargs):
+    purge(sender, instance.pk)
+
+
+def connect_purge_signals(model):
+    """Purge the responses tagged with a model's or an object's key whenever one of its objects is saved or deleted."""
+    dispatch_uid = 'symmetric.purge.' + get_surrogate_key(model)
+    post_save.connect(purge_object, sender=model, dispatch_uid=dispatch_uid)
+    post_delete.connect(purge_object, sender=model, dispatch_uid=dispatch_uid)
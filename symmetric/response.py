@@ -1,14 +1,21 @@
 import json
+import re
 
+from django.conf import settings
 from django.db.models.query import QuerySet
 from django.http import HttpResponse, Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.html import escape
+from django.utils.text import compress_sequence, compress_string
 
 from functions import get_object_data, get_object_list_data
 from symmetric import xml
 
 
 __NO_CACHE = 'max-age=0, no-cache, no-store, must-revalidate'
+__API_GZIP_MIN_SIZE = getattr(settings, 'API_GZIP_MIN_SIZE', None)
+__ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+__API_CORS_CREDENTIALS = getattr(settings, 'API_CORS_CREDENTIALS', False)
 
 
 def __default_dumps(obj):
@@ -41,19 +48,90 @@ def set_response_headers(request, **kwargs):
         request.api_response_headers.update(kwargs)
 
 
-def apply_response_headers(request, response):
+def add_surrogate_keys(request, *keys):
+    if not hasattr(request, 'api_surrogate_keys'):
+        request.api_surrogate_keys = list(keys)
+    else:
+        request.api_surrogate_keys.extend(keys)
+
+
+def apply_response_headers(request, response, cacheable=False):
     if hasattr(request, 'api_response_headers'):
         for header, value in request.api_response_headers.iteritems():
             response[header] = value
     # Django never automatically adds Content-Length to a response unless ConditionalGetMiddleware is used, so do it
-    # here in case the middleware isn't being used
-    response['Content-Length'] = str(len(response.content))
-    response['Cache-Control'] = __NO_CACHE
+    # here in case the middleware isn't being used, a HEAD response has no content to measure
+    if not response.streaming and request.method != 'HEAD':
+        response['Content-Length'] = str(len(response.content))
+    # Only the data of successful reads can be cached, as set by the view, everything else is never cached, including
+    # JSONP errors that are rendered with a 200 status
+    cache_control = getattr(request, 'api_cache_control', None)
+    if cacheable and cache_control and response.status_code == 200 and request.method in ('GET', 'HEAD'):
+        patch_cache_control(response, **cache_control)
+        # The format of the response is negotiated with these headers
+        patch_vary_headers(response, ('Accept', 'X-Requested-With'))
+        # Tag the response for purging from the cache when the objects change
+        if getattr(request, 'api_surrogate_keys', None):
+            response['Surrogate-Key'] = ' '.join(request.api_surrogate_keys)
+            response['Cache-Tag'] = ','.join(request.api_surrogate_keys)
+    else:
+        response['Cache-Control'] = __NO_CACHE
+    origin = getattr(request, 'api_cors_origin', None)
+    if origin is not None:
+        apply_cors_headers(request, response, origin)
+    if __API_GZIP_MIN_SIZE is not None:
+        compress_response(request, response, __API_GZIP_MIN_SIZE)
+
+
+def apply_cors_headers(request, response, origin):
+    """Allow an origin to read the response and the api's own response headers, '' allows no origin."""
+    if origin != '*':
+        patch_vary_headers(response, ('Origin',))
+    if origin:
+        response['Access-Control-Allow-Origin'] = origin
+        # Credentials can only be allowed for a specific origin
+        if __API_CORS_CREDENTIALS and origin != '*':
+            response['Access-Control-Allow-Credentials'] = 'true'
+        if hasattr(request, 'api_response_headers'):
+            response['Access-Control-Expose-Headers'] = ', '.join(request.api_response_headers)
+
+
+def compress_response(request, response, min_size=0):
+    """
+    Gzip the content of a response if the request accepts it, streaming responses are compressed as they are streamed.
+    The compressed content is what any cache stores, so cached responses aren't compressed again.
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if response.has_header('Content-Encoding') or not __ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        return
+    if response.streaming:
+        response.streaming_content = compress_sequence(response.streaming_content)
+        del response['Content-Length']
+    else:
+        if len(response.content) < min_size:
+            return
+        content = compress_string(response.content)
+        # Small responses may not be any smaller
+        if len(content) >= len(response.content):
+            return
+        response.content = content
+        response['Content-Length'] = str(len(content))
+    response['Content-Encoding'] = 'gzip'
 
 
 def render_data(request, data, status=200):
-    """Render data as xml or json based on the request."""
+    """Render data as xml or json based on the request, a HEAD request renders only the headers."""
     if request.api:
+        if request.method == 'HEAD':
+            if not request.api_json:
+                content_type = 'application/xml'
+            elif request.api_json is not True:
+                content_type = 'text/javascript'
+            else:
+                content_type = 'application/json'
+            response = HttpResponse(content_type=content_type, status=status)
+            apply_response_headers(request, response, True)
+            return response
         default = __default_list_dumps if isinstance(data, (tuple, list, set, QuerySet)) else __default_dumps
         if not request.api_json:
             response = HttpResponse(content_type='application/xml', status=status)
@@ -70,7 +148,7 @@ def render_data(request, data, status=200):
                 response.write(';')
         else:
             response = HttpResponse(json.dumps(data, default=default), content_type='application/json', status=status)
-        apply_response_headers(request, response)
+        apply_response_headers(request, response, True)
         return response
     else:
         raise Http404
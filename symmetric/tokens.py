@@ -0,0 +1,115 @@
+import copy
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+
+__API_TOKEN_KEY = getattr(settings, 'API_TOKEN_KEY', None)
+__API_TOKEN_MAX_AGE = getattr(settings, 'API_TOKEN_MAX_AGE', 24 * 60 * 60)
+__API_TOKEN_VERSION = getattr(settings, 'API_TOKEN_VERSION', 1)
+__API_TOKEN_USER_TIMEOUT = getattr(settings, 'API_TOKEN_USER_TIMEOUT', 60)
+__SALT = 'symmetric.tokens'
+
+_users = {}
+
+
+class ApiToken(object):
+    """
+    The verified claims of a token: the user id and the user's flags when the token was issued. Has the same
+    attributes as a user for the requirement checks.
+    """
+    ACTIVE = 1
+    STAFF = 2
+    SUPERUSER = 4
+
+    def __init__(self, user_id, flags):
+        self.user_id = user_id
+        self.flags = flags
+
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_active(self):
+        return bool(self.flags & ApiToken.ACTIVE)
+
+    @property
+    def is_staff(self):
+        return bool(self.flags & ApiToken.STAFF)
+
+    @property
+    def is_superuser(self):
+        return bool(self.flags & ApiToken.SUPERUSER)
+
+
+def __get_version(user_id):
+    """The version of a user's tokens, combining the global API_TOKEN_VERSION with the user's revocation counter."""
+    return '%s.%s' % (__API_TOKEN_VERSION, cache.get('symmetric.tokens.%s' % user_id, 0))
+
+
+def create_token(user):
+    """Create a signed token, that expires after API_TOKEN_MAX_AGE seconds, for a user."""
+    flags = 0
+    if user.is_active:
+        flags |= ApiToken.ACTIVE
+    if user.is_staff:
+        flags |= ApiToken.STAFF
+    if user.is_superuser:
+        flags |= ApiToken.SUPERUSER
+    return signing.dumps([user.pk, flags, __get_version(user.pk)], key=__API_TOKEN_KEY, salt=__SALT, compress=True)
+
+
+def load_token(value):
+    """Return the ApiToken of a signed token, or None if it's invalid, expired, or revoked."""
+    try:
+        user_id, flags, version = signing.loads(value, key=__API_TOKEN_KEY, salt=__SALT, max_age=__API_TOKEN_MAX_AGE)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    if version != __get_version(user_id):
+        return None
+    return ApiToken(user_id, flags)
+
+
+def revoke_tokens(user_id):
+    """
+    Revoke all of the tokens issued to a user so far by incrementing the user's version. The counter never expires,
+    so the tokens issued after the revocation stay valid until their own expiry.
+    """
+    key = 'symmetric.tokens.%s' % user_id
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+    _users.pop(user_id, None)
+
+
+def get_token_user(user_id):
+    """Get a user, cached in this process for API_TOKEN_USER_TIMEOUT seconds, or an AnonymousUser if it was deleted."""
+    now = time.time()
+    entry = _users.get(user_id)
+    if entry is None or entry[0] < now:
+        UserModel = get_user_model()
+        try:
+            entry = (now + __API_TOKEN_USER_TIMEOUT, UserModel._default_manager.get(pk=user_id))
+        except UserModel.DoesNotExist:
+            return AnonymousUser()
+        _users[user_id] = entry
+    # Each request gets its own deep copy, so changes to one request's user, including its state and caches, don't leak
+    # into the others
+    return copy.deepcopy(entry[1])
+
+
+def authenticate_token(request, value):
+    """Authenticate a request by a token, setting request.user to be loaded only when it's used. Returns the ApiToken or None."""
+    if hasattr(request, 'api_token'):
+        return request.api_token
+    token = load_token(value)
+    if token is not None:
+        request.api_token = token
+        request.user = SimpleLazyObject(lambda: get_token_user(token.user_id))
+    return token
@@ -1,6 +1,9 @@
 import ast
 
 from django.conf import settings
+from django.db import models
+from django.db.models import Case, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Concat, Length, Substr
 
 from symmetric.functions import underscore_to_camel_case
 
@@ -250,6 +253,141 @@ def translate_code(code, lang='js', transformer=None):
     return translate_ast(node, token_mapping)
 
 
+_expression_output_fields = {int: models.IntegerField, long: models.IntegerField, float: models.FloatField, str: models.CharField, unicode: models.CharField, bool: models.BooleanField}
+
+_expression_operators = {ast.Add: '__add__', ast.Sub: '__sub__', ast.Mult: '__mul__', ast.Div: '__div__', ast.Mod: '__mod__', ast.BitAnd: 'bitand', ast.BitOr: 'bitor'}
+
+_expression_lookups = {ast.Eq: 'exact', ast.Is: 'exact', ast.Lt: 'lt', ast.LtE: 'lte', ast.Gt: 'gt', ast.GtE: 'gte'}
+
+_expression_reversed_lookups = {'lt': 'gt', 'lte': 'gte', 'gt': 'lt', 'gte': 'lte'}
+
+
+class _ExpressionTranslator(object):
+    """Translate the ast of an api_property into Django ORM expressions, Q objects are used for conditions."""
+
+    def __init__(self, return_type):
+        self.return_type = return_type
+
+    def field_name(self, node):
+        """Return the lookup name of a self attribute, e.g. self.author.name is author__name, or None."""
+        if isinstance(node, ast.Attribute):
+            if isinstance(node.value, ast.Name) and node.value.id == 'self':
+                return node.attr
+            name = self.field_name(node.value)
+            if name:
+                return name + '__' + node.attr
+        return None
+
+    def is_str(self, node):
+        return self.return_type in (str, unicode) or _has_str_node(node) or isinstance(node, ast.Subscript)
+
+    def translate(self, node):
+        name = self.field_name(node)
+        if name:
+            return F(name)
+        elif isinstance(node, ast.Num):
+            return Value(node.n, output_field=_expression_output_fields[type(node.n)]())
+        elif isinstance(node, ast.Str):
+            return Value(node.s, output_field=models.CharField())
+        elif isinstance(node, ast.Name) and node.id in ('True', 'False', 'None'):
+            value = {'True': True, 'False': False, 'None': None}[node.id]
+            return Value(value, output_field=models.BooleanField() if value is not None else None)
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) is ast.Mod and _has_str_node(node.left):
+                return self.translate_format(node)
+            left = self.translate(node.left)
+            right = self.translate(node.right)
+            if type(node.op) is ast.Add and (self.is_str(node.left) or self.is_str(node.right)):
+                return Concat(left, right)
+            operator = _expression_operators.get(type(node.op))
+            if operator:
+                return getattr(left, operator)(right)
+        elif isinstance(node, ast.UnaryOp):
+            if type(node.op) is ast.Not:
+                return ~self.condition(node.operand)
+            elif type(node.op) is ast.UAdd:
+                return self.translate(node.operand)
+            elif type(node.op) is ast.USub:
+                return self.translate(node.operand) * Value(-1, output_field=models.IntegerField())
+        elif isinstance(node, (ast.BoolOp, ast.Compare)):
+            return self.condition(node)
+        elif isinstance(node, ast.IfExp):
+            return Case(When(self.condition(node.test), then=self.translate(node.body)), default=self.translate(node.orelse))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and len(node.args) == 1:
+            if node.func.id == 'len':
+                return Length(self.translate(node.args[0]))
+            elif node.func.id in ('int', 'long', 'float'):
+                return ExpressionWrapper(self.translate(node.args[0]), output_field=_expression_output_fields[eval(node.func.id)]())
+        elif isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice) and not node.slice.step:
+            lower = node.slice.lower.n if node.slice.lower else 0
+            if node.slice.upper:
+                return Substr(self.translate(node.value), lower + 1, node.slice.upper.n - lower)
+            return Substr(self.translate(node.value), lower + 1)
+        raise ValueError('Unable to translate %s to a database expression' % type(node).__name__)
+
+    def translate_format(self, node):
+        """Translate a string format operation (%) into a Concat."""
+        if not isinstance(node.left, ast.Str):
+            raise ValueError('Unable to translate a format string that is not a str to a database expression')
+        elts = node.right.elts if isinstance(node.right, ast.Tuple) else [node.right]
+        parts = []
+        format = node.left.s
+        for elt in elts:
+            idx = format.find('%')
+            while idx != -1 and format[idx + 1] == '%':
+                idx = format.find('%', idx + 2)
+            if idx == -1:
+                break
+            parts.append(format[:idx].replace('%%', '%'))
+            parts.append(self.translate(elt))
+            format = format[idx + 2:]
+        parts.append(format.replace('%%', '%'))
+        parts = [Value(part, output_field=models.CharField()) if isinstance(part, (str, unicode)) else part for part in parts if part != '']
+        return Concat(*parts) if len(parts) > 1 else parts[0]
+
+    def condition(self, node):
+        """Translate a condition into a Q object."""
+        if isinstance(node, ast.BoolOp):
+            conditions = [self.condition(value) for value in node.values]
+            q = conditions[0]
+            for condition in conditions[1:]:
+                q = q & condition if type(node.op) is ast.And else q | condition
+            return q
+        elif isinstance(node, ast.UnaryOp) and type(node.op) is ast.Not:
+            return ~self.condition(node.operand)
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1:
+            op = type(node.ops[0])
+            left, right = node.left, node.comparators[0]
+            name = self.field_name(left)
+            lookup = 'exact' if op in (ast.NotEq, ast.IsNot) else _expression_lookups.get(op)
+            if not name:
+                # Swap the sides, so the field is always on the left
+                name = self.field_name(right)
+                right = left
+                lookup = _expression_reversed_lookups.get(lookup, lookup)
+            if name and lookup:
+                value = self.translate(right)
+                if isinstance(value, Value):
+                    value = value.value
+                    if value is None:
+                        lookup, value = 'isnull', True
+                q = Q(**{'%s__%s' % (name, lookup): value})
+                return ~q if op in (ast.NotEq, ast.IsNot) else q
+        elif self.field_name(node):
+            return Q(**{self.field_name(node): True})
+        raise ValueError('Unable to translate %s to a database condition' % type(node).__name__)
+
+
+def translate_expression(code, return_type=int):
+    """Translate the code of an api_property into a Django ORM expression that can be used to annotate a queryset."""
+    node = ast.parse(code, mode='eval').body
+    expression = _ExpressionTranslator(return_type).translate(node)
+    output_field = _expression_output_fields.get(return_type, models.IntegerField)()
+    if isinstance(expression, Q):
+        return Case(When(expression, then=Value(True)), default=Value(False), output_field=models.BooleanField())
+    return ExpressionWrapper(expression, output_field=output_field)
+
+
 def data_to_objc(data, mutable=True):
     objc = ''
     if callable(data):
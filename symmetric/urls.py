@@ -1,7 +1,95 @@
 from importlib import import_module
 
-from django.core.urlresolvers import reverse
-from django.conf.urls import include, url
+from django.conf import settings
+from django.conf.urls import include
+from django.core.urlresolvers import RegexURLResolver, Resolver404, ResolverMatch, reverse
+from django.utils.encoding import force_text
+
+
+_REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+_REGEX_QUANTIFIERS = set('*+?{')
+
+# The latest version of each api path given to api_patterns with API_STRIP_VERSION, the versions aren't in the patterns
+_latest_versions = {}
+
+
+def _literal_segments(regex):
+    """Return the literal path segments that every path matched by a url regex starts with."""
+    if not regex.startswith('^') or '|' in regex:
+        return ()
+    literal = regex[1:]
+    for i, char in enumerate(literal):
+        if char in _REGEX_SPECIAL_CHARS:
+            # A quantifier makes the character before it optional
+            literal = literal[:max(i - 1, 0)] if char in _REGEX_QUANTIFIERS else literal[:i]
+            break
+    return tuple(literal.split('/')[:-1])
+
+
+class ApiURLResolver(RegexURLResolver):
+    """
+    A RegexURLResolver that only tries the patterns that can match a path, in their original order.
+    The patterns are found with a trie of the literal path segments at the start of each regex.
+    """
+
+    def _get_trie(self):
+        # Each node is a tuple of the pattern indexes and a dict of the child nodes keyed by segment, the trie is
+        # rebuilt if the patterns are replaced or added to, e.g. by a test or a reloaded urlconf
+        url_patterns = self.url_patterns
+        key = (id(url_patterns), len(url_patterns))
+        if getattr(self, '_trie_key', None) != key:
+            trie = ([], {})
+            for i, pattern in enumerate(url_patterns):
+                node = trie
+                for segment in _literal_segments(pattern.regex.pattern):
+                    node = node[1].setdefault(segment, ([], {}))
+                node[0].append(i)
+            self._trie = trie
+            self._trie_key = key
+        return self._trie
+
+    def get_candidate_patterns(self, path):
+        node = self._get_trie()
+        indexes = list(node[0])
+        for segment in path.split('/')[:-1]:
+            node = node[1].get(segment)
+            if node is None:
+                break
+            indexes.extend(node[0])
+        url_patterns = self.url_patterns
+        return [url_patterns[i] for i in sorted(indexes)]
+
+    def resolve(self, path):
+        # The same as RegexURLResolver.resolve, except for trying only the candidate patterns
+        path = force_text(path)
+        tried = []
+        match = self.regex.search(path)
+        if match:
+            new_path = path[match.end():]
+            for pattern in self.get_candidate_patterns(new_path):
+                try:
+                    sub_match = pattern.resolve(new_path)
+                except Resolver404 as e:
+                    sub_tried = e.args[0].get('tried')
+                    if sub_tried is not None:
+                        tried.extend([pattern] + t for t in sub_tried)
+                    else:
+                        tried.append([pattern])
+                else:
+                    if sub_match:
+                        sub_match_dict = dict(match.groupdict(), **self.default_kwargs)
+                        sub_match_dict.update(sub_match.kwargs)
+                        return ResolverMatch(
+                            sub_match.func,
+                            sub_match.args,
+                            sub_match_dict,
+                            sub_match.url_name,
+                            self.app_name or sub_match.app_name,
+                            [self.namespace] + sub_match.namespaces
+                        )
+                    tried.append([pattern])
+            raise Resolver404({'tried': tried, 'path': new_path})
+        raise Resolver404({'path': path})
 
 
 def api_include(urlconf_module, namespace=None, app_name=None):
@@ -24,7 +112,10 @@ def api_patterns(*args):
     or api_patterns('game.urls', ('cart', 'cart.urls'), ('versioned', 'versioned.urls', 3))
     or api_patterns(('versioned', 'versioned.urls', 3))
     The latter examples will create the following versioned urls: /api/versioned/, /api/1/versioned/, ..2, and ..3
+    unless API_STRIP_VERSION is set, where the middleware strips the version so that all versions use /api/versioned/.
+    All of the patterns are returned under a single ApiURLResolver for /api/.
     """
+    strip_version = getattr(settings, 'API_STRIP_VERSION', False)
     apipatterns = []
     for pattern in args:
         latest_version = 0
@@ -40,12 +131,29 @@ def api_patterns(*args):
                 latest_version = pattern[2]
         else:
             continue
-        included = api_include(url_module)
-        apipatterns.append(url('^api/' + api_path, included))
-        if latest_version:
+        urlconf_module, app_name, namespace = api_include(url_module)
+        apipatterns.append(ApiURLResolver('^' + api_path, urlconf_module, app_name=app_name, namespace=namespace))
+        if strip_version:
+            _latest_versions[api_path] = latest_version
+        elif latest_version:
             for i in range(1, latest_version + 1):
-                apipatterns.append(url('^api/%d/%s' % (i, api_path), included))
-    return apipatterns
+                apipatterns.append(ApiURLResolver('^%d/%s' % (i, api_path), urlconf_module, app_name=app_name, namespace=namespace))
+    return [ApiURLResolver(r'^api/', apipatterns)]
+
+
+def get_latest_version(path):
+    """
+    Return the latest version of an unversioned api path given to api_patterns with API_STRIP_VERSION, 0 if it has no
+    versions, or None if it wasn't given to api_patterns.
+    """
+    path = path[5:] if path.startswith('/api/') else path
+    latest_version = None
+    longest = -1
+    for api_path, version in _latest_versions.iteritems():
+        if len(api_path) > longest and path.startswith(api_path):
+            latest_version = version
+            longest = len(api_path)
+    return latest_version
 
 
 def __api_reverse_suffix(path):
@@ -61,7 +169,7 @@ def __api_reverse_suffix(path):
 
 
 def api_reverse(viewname, version=0, urlconf=None, args=None, kwargs=None, prefix=None, current_app=None):
-    path = reverse(viewname, args=args, kwargs=kwargs)
+    path = reverse(viewname, urlconf=urlconf, args=args, kwargs=kwargs, current_app=current_app)
     path = __api_reverse_suffix(path)
     if version > 0:
         return ('/api/%d' % version) + path
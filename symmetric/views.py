@@ -1,20 +1,25 @@
+import calendar
 import hashlib
 import hmac
+import time
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import authenticate, login, logout, get_user_model
-from django.db import IntegrityError
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
 from django.db.models.signals import post_delete
 from django.db.utils import DEFAULT_DB_ALIAS
 from django.http import HttpResponse
-from django.utils.http import urlencode
+from django.utils.http import http_date, urlencode
+from django.utils.timezone import is_aware
 from django.views.decorators.csrf import csrf_exempt
 
-from symmetric.filters import filter_as_authorization
-from symmetric.functions import set_object_data, save_object, _get_api_model
-from symmetric.response import render_error, render_data, render_empty, set_response_headers
-from symmetric.exceptions import InsufficientRoleApiException
+from symmetric.functions import set_object_data, validate_object_data, save_object, update_object_data, get_object_increment_data, decode_natural_key, get_identity_map, _get_api_model
+from symmetric.purge import connect_purge_signals, get_purger, get_surrogate_key, purge
+from symmetric.tokens import authenticate_token, create_token
+from symmetric.response import render_error, render_data, render_empty, set_response_headers, add_surrogate_keys
+from symmetric.exceptions import InsufficientRoleApiException, InvalidIncrementApiException
 
 
 get_model = apps.get_model
@@ -27,6 +32,8 @@ class ApiAction(object):
     UPDATE = 4
     DELETE = 8
     ALL = 15
+    # Not part of ALL, allows a PUT on a collection to create or update the object identified by its natural key
+    UPSERT = 16
 
 
 class ApiRequirement(object):
@@ -37,6 +44,8 @@ class ApiRequirement(object):
     ANONYMOUS_READ = 16
     HMAC = 32
     HTTPS = 64
+    # Allows a signed X-Api-Token header to identify the user instead of the session
+    TOKEN = 128
     NON_USER_REQUIREMENTS = ANONYMOUS_READ | HMAC | HTTPS
 
 
@@ -53,9 +62,13 @@ __ERROR_HMAC = 'Invalid HMAC'
 __ERROR_HTTPS = 'HTTPS is required'
 __ERROR_USERNAME_TAKEN = 'Username is already taken'
 __ERROR_PASSWORD_MISMATCH = 'Passwords do not match'
+__ERROR_NATURAL_KEY = 'A value is required for each natural key field'
+__ERROR_TOKEN = 'Invalid or expired token'
 
 __X_HEADER_NEW_OBJECT_ID = 'X-New-Object-Id'
 __X_HEADER_USER_ID = 'X-User-Id'
+__X_HEADER_API_TOKEN = 'X-Api-Token'
+__HEADER_LAST_MODIFIED = 'Last-Modified'
 
 
 def __exception_error_message(e):
@@ -78,6 +91,7 @@ if type(__API_HMAC_KEY) is unicode:
 __API_HMAC_SALT = getattr(settings, 'API_HMAC_SALT', '')
 if type(__API_HMAC_SALT) is unicode:
     __API_HMAC_SALT = __API_HMAC_SALT.encode('utf-8')
+__API_TOKEN_AUTH = getattr(settings, 'API_TOKEN_AUTH', False)
 
 
 def __check_hmac(request):
@@ -94,18 +108,35 @@ def __check_hmac(request):
     return False
 
 
+def _check_token(request, requirements):
+    """
+    Authenticate the request by its X-Api-Token header when the requirements allow a token, setting request.user.
+    Returns an error response for an invalid token, otherwise None.
+    """
+    if requirements & ApiRequirement.TOKEN and 'HTTP_X_API_TOKEN' in request.META:
+        if authenticate_token(request, request.META['HTTP_X_API_TOKEN']) is None:
+            return render_error(request, __ERROR_TOKEN, 401)
+    return None
+
+
 def _check_requirements(request, requirements):
+    # The token is checked even for an anonymous read, so that the read sees the token's user
+    response = _check_token(request, requirements)
+    if response:
+        return response
     if requirements & ApiRequirement.ANONYMOUS_READ and request.api_action == ApiAction.READ:
         # For an anonymous read, ignore any other user requirements and regardless of request.user.is_anonymous()
         requirements = requirements & ApiRequirement.NON_USER_REQUIREMENTS
+    # A token is checked with the flags signed into it, so neither the session nor the user are loaded
+    user = getattr(request, 'api_token', None) or request.user
     if requirements & ApiRequirement.LOGIN:
-        if not request.user.is_authenticated():
+        if not user.is_authenticated():
             return render_error(request, __ERROR_NOT_AUTHORIZED, 401)
-        elif not request.user.is_active:
+        elif not user.is_active:
             return render_error(request, __ERROR_INACTIVE_ACCOUNT, 403)
-    if requirements & ApiRequirement.STAFF and (not request.user.is_staff or not request.user.is_active):
+    if requirements & ApiRequirement.STAFF and (not user.is_staff or not user.is_active):
         return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
-    if requirements & ApiRequirement.SUPERUSER and (not request.user.is_superuser or not request.user.is_active):
+    if requirements & ApiRequirement.SUPERUSER and (not user.is_superuser or not user.is_active):
         return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
     if type(request.api_json) is not bool and not requirements & ApiRequirement.JSONP:
         return render_error(request, __ERROR_JSONP, 403)
@@ -122,6 +153,20 @@ def _check_requirements(request, requirements):
     return None
 
 
+def stream_json(view):
+    """
+    Decorate a view that accepts request.api_data as a generator of the elements of a JSON array, when the array is
+    larger than API_STREAM_JSON_SIZE.
+    """
+    view.stream_json = True
+    return view
+
+
+def _has_default_save(model):
+    """Return True if neither save nor clean are overridden, so that an UPDATE can safely bypass them."""
+    return model.save.__func__ is models.Model.save.__func__ and model.clean.__func__ is models.Model.clean.__func__
+
+
 class BasicApiView(object):
     """Basic api view, that allows custom actions to mapped to instance methods of: read, create, update, and delete."""
 
@@ -136,6 +181,9 @@ class BasicApiView(object):
     # when there is no object_id or slug argument in the URL - used only for management scripts to inspect
     single_object = False
     requirements = 0
+    cors = None
+    # Set stream_json to True if the actions accept large JSON arrays as a generator, see stream_json()
+    stream_json = False
 
     def __call__(self, request, object_id=None, slug=None):
         # Is the action allowed
@@ -189,21 +237,27 @@ class BasicApiView(object):
         return None
 
 
-def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None):
+def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None, pushdown=False, cors=None, cache_control=None):
     """Generate an api_view with certain requirements and options."""
     if isinstance(model, (str, unicode)):
         model = model.split('.')
         model = get_model(model[0], model[1])
+    # Only push down an UPDATE into a single query when there are no per-object callbacks to run
+    pushdown = pushdown and not callable(authorization) and not callable(verification) and _has_default_save(model)
     slug_field = 'slug'
+    natural_key = None
     deleted_field = None
     nonce_field = None
     request_user_field = None
     request_ip_field = None
-    if not authorization and filter:
-        authorization = filter_as_authorization(model, filter)
+    last_modified_field = None
+    # Without an authorization callback, objects are authorized by fetching them through the filter
+    filter_authorization = not callable(authorization) and callable(filter)
     if hasattr(model, 'API'):
         if hasattr(model.API, 'slug_field'):
             slug_field = model.API.slug_field
+        if hasattr(model.API, 'natural_key'):
+            natural_key = model.API.natural_key
         if hasattr(model.API, 'deleted_field'):
             deleted_field = model.API.deleted_field
         if hasattr(model.API, 'nonce_field') and requirements & ApiRequirement.HMAC:
@@ -212,14 +266,140 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
             request_user_field = model.API.request_user_field
         if hasattr(model.API, 'request_ip_field'):
             request_ip_field = model.API.request_ip_field
+        if hasattr(model.API, 'last_modified_field'):
+            last_modified_field = model.API.last_modified_field
+        if cache_control is None and hasattr(model.API, 'cache_control'):
+            cache_control = model.API.cache_control
+    if not natural_key:
+        natural_key = (slug_field,)
+
+    def api_view_get_object(request, queryset, object_id=None, slug=None):
+        """Get an object by id or slug, raising model.DoesNotExist if it isn't found or is filtered out."""
+        identity_map = get_identity_map(request)
+        if filter_authorization:
+            # The filter must always be queried to authorize the object
+            queryset = filter(request, queryset)
+        elif object_id:
+            obj = identity_map.get(model, object_id)
+            if obj is not None:
+                return obj
+        if object_id:
+            return identity_map.add(queryset.get(id=object_id))
+        else:
+            return identity_map.add(queryset.get(**{slug_field: slug}))
+
+    def api_view_not_found(request, lookup):
+        """Respond with an error for an object not found, or not authorized if it exists but was filtered out."""
+        queryset = model.objects.filter(**lookup)
+        # A deleted object is not found, the same as when it's read
+        if deleted_field:
+            queryset = queryset.filter(**{deleted_field: False})
+        if filter_authorization and queryset.exists():
+            return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
+        return render_error(request, __ERROR_NOT_FOUND, 404)
+
+    def api_view_last_modified(request, value):
+        if value is not None:
+            timestamp = calendar.timegm(value.utctimetuple()) if is_aware(value) else time.mktime(value.timetuple())
+            set_response_headers(request, **{__HEADER_LAST_MODIFIED: http_date(timestamp)})
+
+    def api_view_head_object(request, object_id=None, slug=None):
+        """Respond to a HEAD request for an object with only the columns needed for the headers, without fetching or serializing it."""
+        queryset = model.objects.all()
+        if filter_authorization:
+            queryset = filter(request, queryset)
+        lookup = {'id': object_id} if object_id else {slug_field: slug}
+        fields = [field for field in ('id', deleted_field, last_modified_field) if field]
+        try:
+            values = queryset.values(*fields).get(**lookup)
+        except model.DoesNotExist:
+            return api_view_not_found(request, lookup)
+        if deleted_field and values[deleted_field]:
+            return render_error(request, __ERROR_NOT_FOUND, 404)
+        add_surrogate_keys(request, get_surrogate_key(model, values['id']))
+        if last_modified_field:
+            api_view_last_modified(request, values[last_modified_field])
+        return render_data(request, None)
+
+    def api_view_select_related():
+        select_related_args = _get_api_model(model).select_related_args
+        if select_related_args:
+            return model.objects.select_related(*select_related_args)
+        return model.objects.all()
+
+    def api_view_upsert(request):
+        """Create or update the object identified by the natural key in the data, returning a response."""
+        data = request.api_data
+        try:
+            lookup = decode_natural_key(model, data, natural_key)
+            validate_object_data(model, data)
+        except KeyError:
+            return render_error(request, __ERROR_NATURAL_KEY, 400)
+        except Exception as e:
+            return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+        # Retry once as an update, if a concurrent request created the object first
+        for attempt in range(2):
+            created = False
+            try:
+                with transaction.atomic():
+                    try:
+                        queryset = model.objects.select_for_update()
+                        if filter_authorization:
+                            queryset = filter(request, queryset)
+                        obj = queryset.get(**lookup)
+                        created = False
+                        if callable(authorization) and not authorization(request, obj):
+                            return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
+                    except model.DoesNotExist:
+                        if filter_authorization and model.objects.filter(**lookup).exists():
+                            return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
+                        obj = model(**lookup)
+                        created = True
+                    set_object_data(obj, data, False)
+                    if created and nonce_field:
+                        nonce = request.META.get('HTTP_X_HMAC_NONCE', None)
+                        if nonce:
+                            setattr(obj, nonce_field, nonce)
+                        else:
+                            return render_error(request, __ERROR_HMAC, 403)
+                    if request_user_field and not request.user.is_anonymous():
+                        setattr(obj, request_user_field, request.user)
+                    if request_ip_field:
+                        setattr(obj, request_ip_field, request.META['REMOTE_ADDR'])
+                    if data.get('_data'):
+                        obj._data = data['_data']
+                    if callable(verification) and not verification(request, obj):
+                        return render_error(request, __ERROR_VERIFICATION, 500)
+                    save_object(obj)
+            except (IntegrityError, ValidationError) as e:
+                # The unique constraint of the natural key may have failed, with or without API.validate_unique set
+                if not created or attempt or not model.objects.filter(**lookup).exists():
+                    return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+            except InsufficientRoleApiException as e:
+                return render_error(request, e.message, 401)
+            except InvalidIncrementApiException as e:
+                return render_error(request, e.message, 400)
+            except Exception as e:
+                return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+            else:
+                break
+        if created:
+            set_response_headers(request, **{__X_HEADER_NEW_OBJECT_ID: obj.id})
+            return render_data(request, {_get_api_model(model).id_field[1]: obj.id}, 201)
+        elif hasattr(obj, '_increment_data'):
+            return render_data(request, get_object_increment_data(obj))
+        return render_empty(request)
 
     def api_view_inner(request, object_id=None, slug=None):
         """The api view that automatically processes RESTful requests."""
         if object_id:
             object_id = int(object_id)
 
-        # Is the action allowed
-        if not request.api_action & actions:
+        # Is the action allowed, a PUT on the collection is an upsert
+        action = request.api_action
+        if action == ApiAction.UPDATE and not (object_id or slug) and actions & ApiAction.UPSERT:
+            action = ApiAction.UPSERT
+        if not action & actions:
             return render_error(request, __ERROR_NOT_ALLOWED, 405)
 
         # Does the user pass the requirements
@@ -231,46 +411,48 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
         if not request.api:
             return render_error(request, __ERROR_BAD_REQUEST, 400)
         elif request.api_action == ApiAction.READ:
+            if cache_control:
+                request.api_cache_control = cache_control
             # Get an existing object or collection
-            if object_id or slug:
+            if (object_id or slug) and request.method == 'HEAD' and not callable(authorization):
+                return api_view_head_object(request, object_id, slug)
+            elif object_id or slug:
                 try:
-                    select_related_args = _get_api_model(model).select_related_args
-                    if select_related_args:
-                        if object_id:
-                            obj = model.objects.select_related(*select_related_args).get(id=object_id)
-                        else:
-                            obj = model.objects.select_related(*select_related_args).get(**{slug_field: slug})
-                    else:
-                        if object_id:
-                            obj = model.objects.get(id=object_id)
-                        else:
-                            obj = model.objects.get(**{slug_field: slug})
+                    obj = api_view_get_object(request, api_view_select_related(), object_id, slug)
                     if deleted_field and getattr(obj, deleted_field):
                         return render_error(request, __ERROR_NOT_FOUND, 404)
                     if callable(authorization) and not authorization(request, obj):
                         return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
                 except InsufficientRoleApiException as e:
                     return render_error(request, e.message, 401)
+                except model.DoesNotExist:
+                    return api_view_not_found(request, {'id': object_id} if object_id else {slug_field: slug})
                 except:
                     return render_error(request, __ERROR_NOT_FOUND, 404)
                 else:
+                    add_surrogate_keys(request, get_surrogate_key(model, obj.id))
+                    if last_modified_field:
+                        api_view_last_modified(request, getattr(obj, last_modified_field))
                     return render_data(request, obj)
             else:
-                # Get a collection
-                select_related_args = _get_api_model(model).select_related_args
-                if select_related_args:
-                    if callable(filter):
-                        queryset = filter(request, model.objects.select_related(*select_related_args))
-                    else:
-                        queryset = model.objects.select_related(*select_related_args).all()
-                else:
-                    if callable(filter):
-                        queryset = filter(request, model.objects.all())
-                    else:
-                        queryset = model.objects.all()
+                # Get a collection, the filters run any counts for the headers of a HEAD request
+                add_surrogate_keys(request, get_surrogate_key(model))
+                queryset = api_view_select_related()
+                if callable(filter):
+                    queryset = filter(request, queryset)
                 if deleted_field:
                     queryset = queryset.filter(**{deleted_field: False})
+                if request.method == 'HEAD':
+                    if last_modified_field:
+                        api_view_last_modified(request, queryset.aggregate(last_modified=models.Max(last_modified_field))['last_modified'])
+                    return render_data(request, None)
+                if last_modified_field:
+                    # Evaluates the queryset, render_data then uses its result cache, a nullable field may have no value
+                    values = [value for value in (getattr(obj, last_modified_field) for obj in queryset) if value is not None]
+                    api_view_last_modified(request, max(values) if values else None)
                 return render_data(request, queryset)
+        elif action == ApiAction.UPSERT:
+            return api_view_upsert(request)
         elif request.api_action == ApiAction.CREATE:
             # Create a new object on a collection only
             if object_id or slug:
@@ -278,7 +460,7 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
             else:
                 try:
                     obj = model()
-                    set_object_data(obj, request.POST)
+                    set_object_data(obj, request.api_data)
                     if nonce_field:
                         nonce = request.META.get('HTTP_X_HMAC_NONCE', None)
                         if nonce:
@@ -289,47 +471,81 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
                         setattr(obj, request_user_field, request.user)
                     if request_ip_field:
                         setattr(obj, request_ip_field, request.META['REMOTE_ADDR'])
-                    if request.POST.get('_data'):
-                        obj._data = request.POST['_data']
+                    if request.api_data.get('_data'):
+                        obj._data = request.api_data['_data']
                     if callable(verification) and not verification(request, obj):
                         return render_error(request, __ERROR_VERIFICATION, 500)
                     save_object(obj)
                 except InsufficientRoleApiException as e:
                     return render_error(request, e.message, 401)
+                except InvalidIncrementApiException as e:
+                    return render_error(request, e.message, 400)
                 except Exception as e:
                     return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
                 set_response_headers(request, **{__X_HEADER_NEW_OBJECT_ID: obj.id})
                 return render_data(request, {_get_api_model(model).id_field[1]: obj.id}, 201)
         elif request.api_action == ApiAction.UPDATE:
+            # Update an existing object with a single query, without fetching it first
+            if (object_id or slug) and pushdown and not request.api_data.get('_data'):
+                if callable(filter):
+                    queryset = filter(request, model.objects.all())
+                else:
+                    queryset = model.objects.all()
+                lookup = {'id': object_id} if object_id else {slug_field: slug}
+                queryset = queryset.filter(**lookup)
+                values = {}
+                if request_user_field and not request.user.is_anonymous():
+                    values[request_user_field] = request.user
+                if request_ip_field:
+                    values[request_ip_field] = request.META['REMOTE_ADDR']
+                # Save signals aren't sent, so find the ids of the objects updated by slug to purge them
+                object_ids = [object_id] if object_id else []
+                if not object_id and get_purger() is not None:
+                    object_ids = list(queryset.values_list('id', flat=True))
+                try:
+                    count, increment_data = update_object_data(queryset, request.api_data, **values)
+                except InsufficientRoleApiException as e:
+                    return render_error(request, e.message, 401)
+                except Exception as e:
+                    return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+                if count == 0:
+                    return api_view_not_found(request, lookup)
+                elif count is not None:
+                    if object_ids:
+                        for updated_id in object_ids:
+                            purge(model, updated_id)
+                    else:
+                        purge(model)
+                    if increment_data:
+                        return render_data(request, increment_data)
+                    return render_empty(request)
+                # Otherwise the data has included objects, so fall back to fetching and saving the object
             # Update an existing object only
             if object_id or slug:
                 try:
-                    select_related_args = _get_api_model(model).select_related_args
-                    if select_related_args:
-                        if object_id:
-                            obj = model.objects.select_related(*select_related_args).get(id=object_id)
-                        else:
-                            obj = model.objects.select_related(*select_related_args).get(**{slug_field: slug})
-                    else:
-                        if object_id:
-                            obj = model.objects.get(id=object_id)
-                        else:
-                            obj = model.objects.get(**{slug_field: slug})
+                    # Reject invalid data before fetching the object
+                    validate_object_data(model, request.api_data)
+                except Exception as e:
+                    return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+                try:
+                    obj = api_view_get_object(request, api_view_select_related(), object_id, slug)
                     if callable(authorization) and not authorization(request, obj):
                         return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
                 except InsufficientRoleApiException as e:
                     return render_error(request, e.message, 401)
+                except model.DoesNotExist:
+                    return api_view_not_found(request, {'id': object_id} if object_id else {slug_field: slug})
                 except:
                     return render_error(request, __ERROR_NOT_FOUND, 404)
                 else:
                     try:
-                        set_object_data(obj, request.PUT)
+                        set_object_data(obj, request.api_data, False)
                         if request_user_field and not request.user.is_anonymous():
                             setattr(obj, request_user_field, request.user)
                         if request_ip_field:
                             setattr(obj, request_ip_field, request.META['REMOTE_ADDR'])
-                        if request.PUT.get('_data'):
-                            obj._data = request.PUT['_data']
+                        if request.api_data.get('_data'):
+                            obj._data = request.api_data['_data']
                         if callable(verification) and not verification(request, obj):
                             return render_error(request, __ERROR_VERIFICATION, 500)
                         save_object(obj)
@@ -337,6 +553,9 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
                         return render_error(request, e.message, 401)
                     except Exception as e:
                         return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+                    if hasattr(obj, '_increment_data'):
+                        # Respond with the new values of the incremented fields
+                        return render_data(request, get_object_increment_data(obj))
                     return render_empty(request)
             else:
                 return render_error(request, __ERROR_NOT_ALLOWED, 405)
@@ -344,14 +563,13 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
             # Delete an existing object only
             if object_id or slug:
                 try:
-                    if object_id:
-                        obj = model.objects.get(id=object_id)
-                    else:
-                        obj = model.objects.get(**{slug_field: slug})
+                    obj = api_view_get_object(request, model.objects.all(), object_id, slug)
                     if callable(authorization) and not authorization(request, obj):
                         return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
                 except InsufficientRoleApiException as e:
                     return render_error(request, e.message, 401)
+                except model.DoesNotExist:
+                    return api_view_not_found(request, {'id': object_id} if object_id else {slug_field: slug})
                 except Exception:
                     return render_error(request, __ERROR_NOT_FOUND, 404)
                 else:
@@ -363,24 +581,32 @@ def api_view(model, actions=ApiAction.READ, requirements=0, filter=None, authori
                             # Send the post_delete signal
                             post_delete.send_robust(sender=obj.__class__, instance=obj, using=DEFAULT_DB_ALIAS)
                     else:
+                        get_identity_map(request).remove(obj)
                         obj.delete()
                     return render_empty(request)
             else:
                 return render_error(request, __ERROR_NOT_ALLOWED, 405)
 
+    connect_purge_signals(model)
+
+    # The middleware answers CORS preflight requests from these without calling the view
+    api_view_inner.actions = actions
+    api_view_inner.cors = cors
     return api_view_inner
 
 
-def api_related_view(model, related_model, related_field, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None):
+def api_related_view(model, related_model, related_field, actions=ApiAction.READ, requirements=0, filter=None, authorization=None, verification=None, cors=None, cache_control=None):
     """
     Returns a view got getting a collection of related elements, or POSTing a new one. Other operations are not allowed.
     """
 
-    # Do not allow UPDATE or DELETE
+    # Do not allow UPDATE, DELETE, or UPSERT
     if actions & ApiAction.UPDATE:
         actions -= ApiAction.UPDATE
     if actions & ApiAction.DELETE:
         actions -= ApiAction.DELETE
+    if actions & ApiAction.UPSERT:
+        actions -= ApiAction.UPSERT
 
     if isinstance(model, (str, unicode)):
         model = model.split('.')
@@ -407,6 +633,8 @@ def api_related_view(model, related_model, related_field, actions=ApiAction.READ
         if hasattr(related_model.API, 'request_ip_field'):
             request_ip_field = related_model.API.request_ip_field
 
+    related_attname = related_model._meta.get_field(related_field).attname
+
     def api_related_view_filter(request, queryset):
         if request.api_related_id:
             queryset = queryset.filter(**{related_field + '_id': request.api_related_id})
@@ -416,7 +644,8 @@ def api_related_view(model, related_model, related_field, actions=ApiAction.READ
             queryset = filter(request, queryset)
         return queryset
 
-    related_view = api_view(related_model, actions, requirements=0, filter=api_related_view_filter)
+    related_view = api_view(related_model, actions, requirements=0, filter=api_related_view_filter, cache_control=cache_control)
+    connect_purge_signals(model)
 
     def api_related_view_inner(request, object_id=None, slug=None):
         if object_id:
@@ -434,17 +663,37 @@ def api_related_view(model, related_model, related_field, actions=ApiAction.READ
 
         if not request.api:
             return render_error(request, __ERROR_BAD_REQUEST, 400)
+        elif not object_id and not slug:
+            return render_error(request, __ERROR_NOT_FOUND, 404)
         else:
-            # Check for object existence and authorization first
+            if request.api_action == ApiAction.CREATE:
+                try:
+                    # Reject invalid data before checking the object
+                    validate_object_data(related_model, request.api_data)
+                except Exception as e:
+                    return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
+            # Check for object existence and authorization first, loading only what the checks need
+            obj = None
+            lookup = {'id': object_id} if object_id else {slug_field: slug}
             try:
                 if object_id:
-                    obj = model.objects.get(id=object_id)
-                else:
-                    obj = model.objects.get(**{slug_field: slug})
-                if deleted_field and getattr(obj, deleted_field):
-                    return render_error(request, __ERROR_NOT_FOUND, 404)
-                if callable(authorization) and not authorization(request, obj):
-                    return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
+                    obj = get_identity_map(request).get(model, object_id)
+                if callable(authorization) or obj is not None:
+                    if obj is None:
+                        obj = get_identity_map(request).add(model.objects.get(**lookup))
+                    if deleted_field and getattr(obj, deleted_field):
+                        return render_error(request, __ERROR_NOT_FOUND, 404)
+                    if callable(authorization) and not authorization(request, obj):
+                        return render_error(request, __ERROR_NOT_AUTHORIZED, 403)
+                    object_id = obj.id
+                elif deleted_field:
+                    object_id, deleted = model.objects.filter(**lookup).values_list('id', deleted_field).get()
+                    if deleted:
+                        return render_error(request, __ERROR_NOT_FOUND, 404)
+                elif request.api_action == ApiAction.CREATE:
+                    object_id = model.objects.filter(**lookup).values_list('id', flat=True).get()
+                # Otherwise, there is nothing to check, so don't fetch the object at all, the related objects are
+                # filtered by the object's id or joined on its slug, and will be empty if it doesn't exist
             except InsufficientRoleApiException as e:
                 return render_error(request, e.message, 401)
             except:
@@ -453,8 +702,11 @@ def api_related_view(model, related_model, related_field, actions=ApiAction.READ
                 try:
                     # Create a new related object
                     related_obj = related_model()
-                    set_object_data(related_obj, request.POST)
-                    setattr(related_obj, related_field, obj)
+                    set_object_data(related_obj, request.api_data, False)
+                    if obj is not None:
+                        setattr(related_obj, related_field, obj)
+                    else:
+                        setattr(related_obj, related_attname, object_id)
                     if nonce_field:
                         nonce = request.META.get('HTTP_X_HMAC_NONCE', None)
                         if nonce:
@@ -465,28 +717,37 @@ def api_related_view(model, related_model, related_field, actions=ApiAction.READ
                         setattr(related_obj, request_user_field, request.user)
                     if request_ip_field:
                         setattr(related_obj, request_ip_field, request.META['REMOTE_ADDR'])
-                    if request.POST.has_key('_data'):
-                        related_obj._data = request.POST['_data']
+                    if request.api_data.has_key('_data'):
+                        related_obj._data = request.api_data['_data']
                     if callable(verification) and not verification(request, related_obj):
                         return render_error(request, __ERROR_VERIFICATION, 500)
                     save_object(related_obj)
+                except InvalidIncrementApiException as e:
+                    return render_error(request, e.message, 400)
                 except Exception as e:
                     return render_error(request, '%s: %s' % (e.__class__.__name__, __exception_error_message(e)), 500)
                 set_response_headers(request, **{__X_HEADER_NEW_OBJECT_ID: related_obj.id})
                 return render_data(request, {_get_api_model(related_model).id_field[1]: related_obj.id}, 201)
             else:
                 # Do not pass on the model object_id or slug to read the related objects, but save them in the
-                # request for access in the filters
+                # request for access in the filters, any slug is already resolved to an id if the object was fetched
                 request.api_related_id = object_id
                 request.api_related_slug = slug
+                if object_id:
+                    add_surrogate_keys(request, get_surrogate_key(model, object_id))
                 return related_view(request)
 
+    api_related_view_inner.actions = actions
+    api_related_view_inner.cors = cors
     return api_related_view_inner
 
 
 class ApiView(object):
     actions = ApiAction.READ
     requirements = 0
+    pushdown = False
+    cors = None
+    cache_control = None
 
     @classmethod
     def as_view(cls, **initkwargs):
@@ -503,12 +764,14 @@ class ApiView(object):
             verification = instance.verification
         else:
             verification = None
-        return api_view(instance.model, instance.actions, instance.requirements, filter, authorization, verification)
+        return api_view(instance.model, instance.actions, instance.requirements, filter, authorization, verification, instance.pushdown, instance.cors, instance.cache_control)
 
 
 class ApiRelatedView(object):
     actions = ApiAction.READ
     requirements = 0
+    cors = None
+    cache_control = None
 
     @classmethod
     def as_view(cls, **initkwargs):
@@ -525,7 +788,7 @@ class ApiRelatedView(object):
             verification = instance.verification
         else:
             verification = None
-        return api_related_view(instance.model, instance.related_model, instance.related_field, instance.actions, instance.requirements, filter, authorization, verification)
+        return api_related_view(instance.model, instance.related_model, instance.related_field, instance.actions, instance.requirements, filter, authorization, verification, instance.cors, instance.cache_control)
 
 
 class AuthChallenge(Exception):
@@ -561,6 +824,8 @@ def api_login_view(request):
         else:
             login(request, user)
             set_response_headers(request, **{__X_HEADER_USER_ID: user.id})
+            if __API_TOKEN_AUTH:
+                set_response_headers(request, **{__X_HEADER_API_TOKEN: create_token(user)})
             # Tell the CsrfViewMiddleware to add the csrftoken cookie to the
             # response (see Django's @ensure_csrf_cookie and get_token())
             if getattr(settings, 'API_CSRF', True):
@@ -588,6 +853,12 @@ class ApiCurrentUserView(BasicApiView):
 
     def __call__(self, request):
         """Return the current user object."""
+        # Identify the user by a token before using request.user, the other requirements are then checked by the view
+        response = _check_token(request, self.requirements)
+        if response:
+            return response
+        # The user is already loaded, so don't fetch it again
+        get_identity_map(request).add(request.user)
         return self.api_view(request, request.user.id)
 
     @property
@@ -626,6 +897,10 @@ class ApiCurrentUserRelatedView(BasicApiView):
 
     def __call__(self, request):
         """Only return objects associated with the current user."""
+        response = _check_token(request, self.requirements)
+        if response:
+            return response
+        get_identity_map(request).add(request.user)
         return self.api_related_view(request, request.user.id)
 
     @property
@@ -710,6 +985,8 @@ def api_create_user_view(request):
             user.backend = 'django.contrib.auth.backends.ModelBackend'
             login(request, user)
             set_response_headers(request, **{__X_HEADER_USER_ID: user.id})
+            if __API_TOKEN_AUTH:
+                set_response_headers(request, **{__X_HEADER_API_TOKEN: create_token(user)})
             # Tell the CsrfViewMiddleware to add the csrftoken cookie to the response
             if getattr(settings, 'API_CSRF', True):
                 request.META['CSRF_COOKIE_USED'] = True
@@ -0,0 +1,71 @@
+import logging
+
+import django
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.wsgi import WSGIHandler
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger('django.request')
+
+
+_DEFAULT_API_MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'symmetric.middleware.ApiMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
+)
+
+
+class ApiWSGIHandler(WSGIHandler):
+    """A WSGIHandler for api requests that only loads the middleware in the API_MIDDLEWARE_CLASSES setting."""
+
+    def load_middleware(self):
+        # The same as BaseHandler.load_middleware, except for the setting
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._response_middleware = []
+        self._exception_middleware = []
+
+        request_middleware = []
+        for middleware_path in getattr(settings, 'API_MIDDLEWARE_CLASSES', _DEFAULT_API_MIDDLEWARE_CLASSES):
+            mw_class = import_string(middleware_path)
+            try:
+                mw_instance = mw_class()
+            except MiddlewareNotUsed:
+                logger.debug('MiddlewareNotUsed: %r', middleware_path)
+                continue
+
+            if hasattr(mw_instance, 'process_request'):
+                request_middleware.append(mw_instance.process_request)
+            if hasattr(mw_instance, 'process_view'):
+                self._view_middleware.append(mw_instance.process_view)
+            if hasattr(mw_instance, 'process_template_response'):
+                self._template_response_middleware.insert(0, mw_instance.process_template_response)
+            if hasattr(mw_instance, 'process_response'):
+                self._response_middleware.insert(0, mw_instance.process_response)
+            if hasattr(mw_instance, 'process_exception'):
+                self._exception_middleware.insert(0, mw_instance.process_exception)
+
+        self._request_middleware = request_middleware
+
+
+class ApiWSGIApplication(object):
+    """A WSGI application that handles api requests with an ApiWSGIHandler, and all other requests with a normal WSGIHandler."""
+
+    def __init__(self):
+        self.api_handler = ApiWSGIHandler()
+        self.handler = WSGIHandler()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/api/'):
+            return self.api_handler(environ, start_response)
+        return self.handler(environ, start_response)
+
+
+def get_api_wsgi_application():
+    """Use in place of django.core.wsgi.get_wsgi_application to handle api requests with less middleware."""
+    django.setup()
+    return ApiWSGIApplication()
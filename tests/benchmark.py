@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""
+Opt-in benchmarks, not run with the tests, since timings vary between machines: python -m tests.benchmark
+"""
+import datetime
+import os
+import timeit
+
+import django
+
+
+def benchmark_datetimes():
+    from symmetric.functions import datetime_to_iso_8601, iso_8601_to_datetime
+    # The slicing parser and formatter should beat strptime and isoformat
+    iso = '2013-01-14T16:45:56+04:25'
+    dt = iso_8601_to_datetime(iso)
+    timings = (
+        ('iso_8601_to_datetime', lambda: iso_8601_to_datetime(iso)),
+        ('strptime', lambda: datetime.datetime.strptime(iso[:19], '%Y-%m-%dT%H:%M:%S')),
+        ('datetime_to_iso_8601', lambda: datetime_to_iso_8601(dt)),
+        ('isoformat', lambda: dt.replace(microsecond=0).isoformat()),
+    )
+    for name, function in timings:
+        print('%-24s %.2fus' % (name, min(timeit.repeat(function, number=2000, repeat=3)) / 2000 * 1000000))
+
+
+if __name__ == '__main__':
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+    benchmark_datetimes()
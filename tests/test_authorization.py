@@ -0,0 +1,75 @@
+from django.contrib.auth.models import AnonymousUser
+from django.db import models
+from django.test import TestCase
+
+from symmetric.authorization import AuthorizationCache
+
+
+class Project(models.Model):
+    name = models.CharField(max_length=127)
+    public = models.BooleanField(default=False)
+
+
+class ProjectMember(models.Model):
+    project = models.ForeignKey(Project)
+
+
+def public_projects(request, queryset):
+    return queryset.filter(public=True)
+
+
+class FakeRequest(object):
+    user = AnonymousUser()
+
+
+class ApiAuthorizationCacheTest(TestCase):
+
+    def setUp(self):
+        self.projects = [Project.objects.create(name='Project %d' % i, public=bool(i % 2)) for i in range(10)]
+
+    def test_authorization_cache(self):
+        authorization = AuthorizationCache(Project, public_projects, invalidate_on=(ProjectMember,))
+        request = FakeRequest()
+        with self.assertNumQueries(1):
+            for project in self.projects:
+                self.assertEqual(authorization(request, project), project.public)
+        ids = [project.id for project in self.projects]
+        with self.assertNumQueries(0):
+            self.assertEqual(authorization.filter_ids(request, ids), [project.id for project in self.projects if project.public])
+
+        # Cached until invalidated
+        private = self.projects[0]
+        Project.objects.filter(id=private.id).update(public=True)
+        self.assertFalse(authorization(request, private))
+        authorization.invalidate()
+        self.assertTrue(authorization(request, private))
+
+        Project.objects.filter(id=private.id).update(public=False)
+        ProjectMember.objects.create(project=private)
+        with self.assertNumQueries(1):
+            self.assertFalse(authorization(request, private))
+
+    def test_local_ids(self):
+        authorization = AuthorizationCache(Project, public_projects, name='local')
+        public = self.projects[1]
+        self.assertTrue(authorization(FakeRequest(), public))
+
+        # Another request uses the ids in the process, and only reads the generations from the shared cache, once
+        authorization.cache.delete(authorization._get_key(FakeRequest.user))
+        calls = []
+        get_many = authorization.cache.get_many
+        authorization.cache.get_many = lambda keys, version=None: calls.append(keys) or get_many(keys, version)
+        try:
+            request = FakeRequest()
+            with self.assertNumQueries(0):
+                for project in self.projects:
+                    self.assertEqual(authorization(request, project), project.public)
+        finally:
+            del authorization.cache.get_many
+        self.assertEqual(len(calls), 1)
+
+        # A user's ids are invalidated for every process
+        Project.objects.filter(id=public.id).update(public=False)
+        authorization._local = {}
+        authorization.invalidate(FakeRequest.user)
+        self.assertFalse(authorization(FakeRequest(), public))
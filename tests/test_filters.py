@@ -2,8 +2,9 @@ from django.conf import settings
 from django.db import models
 from django.test import TestCase
 
-from symmetric.filters import subclass_filter
+from symmetric.filters import field_filter, order_by_filter, subclass_filter
 from symmetric.functions import datetime_to_iso_8601, get_object_list_data
+from symmetric.models import api_property
 
 
 class Place(models.Model):
@@ -11,7 +12,13 @@ class Place(models.Model):
     website = models.CharField(max_length=255, blank=True)
     description = models.TextField(blank=True)
     attributes = models.IntegerField(default=0)
+    kind = models.CharField(max_length=31, blank=True)
     created = models.DateTimeField(auto_now_add=True)
+    score = api_property('self.attributes * 2 + len(self.name)')
+
+    class API:
+        filter_fields = ('score',)
+        order_by_fields = ('score', 'name')
 
 
 class Restaurant(Place):
@@ -29,6 +36,12 @@ def fake_request():
     pass
 
 
+class FakeRequest(object):
+
+    def __init__(self, **params):
+        self.GET = params
+
+
 class ApiSubclassFilterTest(TestCase):
 
     def setUp(self):
@@ -38,14 +51,16 @@ class ApiSubclassFilterTest(TestCase):
             attributes=16,
             seating_capacity=35,
             average_rating=4.6,
-            cuisine='Good Food'
+            cuisine='Good Food',
+            kind='restaurant'
         )
         self.store = Store.objects.create(
             name='Sneaker Shoppe',
             website='sneakershoppe.com',
             attributes=10,
             type=2,
-            average_price=67.90
+            average_price=67.90,
+            kind='store'
         )
 
     def test_subclass_filter(self):
@@ -68,3 +83,41 @@ class ApiSubclassFilterTest(TestCase):
             self.assertEqual(obj.description, data['description'])
             self.assertEqual(obj.attributes, data['attributes'])
             self.assertEqual(datetime_to_iso_8601(obj.created), data['created'])
+
+    def assertSubclasses(self, queryset, num_queries):
+        with self.assertNumQueries(num_queries):
+            places = list(queryset.order_by('id'))
+        self.assertEqual([type(place) for place in places], [Restaurant, Store, Place])
+        self.assertEqual(places[0].cuisine, 'Good Food')
+        self.assertEqual(places[1].type, 2)
+
+    def test_subclass_filter_strategies(self):
+        Place.objects.create(name='Park')
+        queryset = subclass_filter(Restaurant, Store, strategy='prefetch')(fake_request, Place.objects.all())
+        self.assertSubclasses(queryset, 3)
+        queryset = subclass_filter(Restaurant, Store, discriminator='kind')(fake_request, Place.objects.all())
+        self.assertSubclasses(queryset, 1)
+        # Only the subclasses present are queried
+        queryset = subclass_filter(Restaurant, Store, strategy='prefetch', discriminator=('kind', {'restaurant': Restaurant, 'store': 'tests.Store'}))
+        self.assertSubclasses(queryset(fake_request, Place.objects.all()), 3)
+        with self.assertNumQueries(2):
+            places = list(queryset(fake_request, Place.objects.exclude(kind='store')).order_by('id'))
+        self.assertEqual([type(place) for place in places], [Restaurant, Place])
+
+
+class ApiPropertyFilterTest(TestCase):
+
+    def setUp(self):
+        Place.objects.create(name='Park', attributes=10)
+        Place.objects.create(name='Museum', attributes=1)
+        Place.objects.create(name='Zoo', attributes=6)
+
+    def test_order_by_api_property(self):
+        queryset = order_by_filter(FakeRequest(orderby='-score'), Place.objects.all())
+        self.assertEqual([place.name for place in queryset], ['Park', 'Zoo', 'Museum'])
+        self.assertEqual([place.score for place in queryset], [24, 15, 8])
+
+    def test_filter_api_property(self):
+        queryset = field_filter(FakeRequest(score='15'), Place.objects.all())
+        self.assertEqual([place.name for place in queryset], ['Zoo'])
+        self.assertEqual(field_filter(FakeRequest(score='x'), Place.objects.all()).count(), 0)
@@ -1,6 +1,28 @@
+import datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator
+from django.db import models
 from django.test import TestCase
+from django.utils import timezone
 
 from symmetric.functions import *
+from symmetric.functions import _compile_field_validator, _get_api_model, _get_fixed_timezone
+
+
+class Sensor(models.Model):
+    serial = models.CharField(max_length=32, unique=True)
+
+    class API:
+        natural_key = ('serial',)
+        validate_unique = 'database'
+
+
+class Reading(models.Model):
+    sensor = models.ForeignKey(Sensor)
+    value = models.FloatField(default=0.0)
+    taken = models.DateTimeField()
 
 
 class ApiFunctionsTest(TestCase):
@@ -30,3 +52,35 @@ class ApiFunctionsTest(TestCase):
         self.assertAttributes(iso_8601_to_datetime('2013-01-14T16:45:56.105Z'), year=2013, month=1, day=14, hour=16, minute=45, second=56)
         self.assertAttributes(iso_8601_to_datetime('2013-01-14T16:45:56+04:25'), year=2013, month=1, day=14, hour=16, minute=45, second=56)
         self.assertAttributes(iso_8601_to_datetime('2013-01-14T16:45:56.105+04:25'), year=2013, month=1, day=14, hour=16, minute=45, second=56)
+        self.assertEqual(iso_8601_to_datetime('2013-01-14T16:45:56-04:30').utcoffset(), datetime.timedelta(hours=-4, minutes=-30))
+        self.assertEqual(iso_8601_to_datetime('2013-01-14T16:45:56'), timezone.make_aware(datetime.datetime(2013, 1, 14, 16, 45, 56), timezone.get_current_timezone()))
+        self.assertAttributes(iso_8601_to_time('16:45:56'), hour=16, minute=45, second=56)
+        for iso in ('2013-01-14 16:45:56Z', '2013-01-14T16:45:5xZ', '2013-01-14T16:45:56+04', '2013-13-14T16:45:56Z', '2013-01'):
+            self.assertRaises(ValueError, iso_8601_to_datetime, iso)
+        self.assertRaises(ValueError, iso_8601_to_time, '16-45-56')
+
+    def test_datetime_formatting(self):
+        for iso in ('2013-01-14T16:45:56+00:00', '2013-01-14T16:45:56+04:25', '0999-01-14T16:45:56-04:30'):
+            self.assertEqual(datetime_to_iso_8601(iso_8601_to_datetime(iso)), iso)
+        self.assertEqual(datetime_to_iso_8601(iso_8601_to_datetime('2013-01-14T16:45:56.105Z')), '2013-01-14T16:45:56+00:00')
+        self.assertEqual(datetime_to_iso_8601(datetime.datetime(2013, 1, 14, 16, 45, 56, 105)), '2013-01-14T16:45:56')
+        self.assertEqual(date_to_iso_8601(datetime.date(2013, 1, 4)), '2013-01-04')
+        self.assertEqual(time_to_iso_8601(datetime.time(6, 5, 4, 3)), '06:05:04')
+        self.assertEqual(time_to_iso_8601(datetime.time(6, 5, 4, 3, _get_fixed_timezone(-90))), '06:05:04-01:30')
+
+    def test_compile_api_models(self):
+        timings = compile_api_models([Sensor, Reading])
+        self.assertEqual(set(timings.keys()), set([Sensor, Reading]))
+        api_model = _get_api_model(Sensor)
+        self.assertTrue(api_model is _get_api_model(Sensor))
+        self.assertEqual(api_model.validate_unique, 'database')
+
+    def test_field_validator(self):
+        field = models.DecimalField(max_digits=5, decimal_places=2, validators=[MaxValueValidator(Decimal('10'))])
+        field.set_attributes_from_name('price')
+        validate = _compile_field_validator(field)
+        # Values are converted by the field before they're validated
+        validate('5.50')
+        validate(5.5)
+        self.assertRaises(ValidationError, validate, '10.50')
+        self.assertRaises(ValidationError, validate, 'x')
@@ -1,13 +1,21 @@
+import gzip
+import io
+import json
+import zlib
 from importlib import import_module
 
 from django.conf import settings
 from django.conf.urls import url
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.test.client import Client
+from django.utils.functional import empty
 
+from symmetric.functions import iter_json_array
+from symmetric.middleware import ApiMiddleware
 from symmetric.urls import api_reverse
+from symmetric.views import stream_json
 
 
 def api_test(request):
@@ -32,6 +40,11 @@ def api_version_test(request):
         return HttpResponse(status=400)
 
 
+@stream_json
+def api_stream_test(request):
+    return HttpResponse(str(sum(1 for obj in request.api_data)))
+
+
 class ApiTest(TestCase):
 
     def setUp(self):
@@ -66,3 +79,106 @@ class ApiTest(TestCase):
 
         response = c.get(api_reverse(api_version_test, 1) + '?version=2')
         self.assertNotEqual(response.status_code, 200)
+
+
+class ApiDataTest(TestCase):
+
+    def process(self, data, compress=None, chunked=False, **extra):
+        body = compress(json.dumps(data)) if compress else json.dumps(data)
+        request = RequestFactory().post('/api/orders/', body, content_type='application/json', **extra)
+        if chunked:
+            # A chunked body has no Content-Length
+            del request.META['CONTENT_LENGTH']
+        return request, ApiMiddleware().process_request(request)
+
+    def test_json_data(self):
+        request, response = self.process({'total': 5, 'customer': {'name': 'Jane'}, 'tags': [1, 2]})
+        self.assertIsNone(response)
+        self.assertEqual(request.api_data, {'total': 5, 'customer': {'name': 'Jane'}, 'tags': [1, 2]})
+        # The QueryDict is only created when used
+        self.assertTrue(request.POST._wrapped is empty)
+        self.assertEqual(request.POST['total'], 5)
+
+    def test_max_body_size(self):
+        ApiMiddleware._API_MAX_BODY_SIZE = 16
+        try:
+            request, response = self.process({'name': 'x' * 16}, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 413)
+            # The bytes read are limited without a Content-Length, compressed or not
+            request, response = self.process({'name': 'x' * 16}, chunked=True, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 413)
+            request, response = self.process({'name': 'x' * 100}, zlib.compress, chunked=True, HTTP_CONTENT_ENCODING='deflate', HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 413)
+            request, response = self.process({'a': 1}, chunked=True)
+            self.assertIsNone(response)
+            self.assertEqual(request.api_data, {'a': 1})
+        finally:
+            ApiMiddleware._API_MAX_BODY_SIZE = None
+
+    def test_patch_form(self):
+        request = RequestFactory().patch('/api/orders/', 'total=5&name=Jane', content_type='application/x-www-form-urlencoded')
+        self.assertIsNone(ApiMiddleware().process_request(request))
+        self.assertEqual(request.api_data['total'], '5')
+        self.assertEqual(request.PATCH['name'], 'Jane')
+
+    def test_stream_json_array(self):
+        data = [{'total': i} for i in range(10)]
+        ApiMiddleware._API_STREAM_JSON_SIZE = 16
+        try:
+            request, response = self.process(data)
+            ApiMiddleware().process_view(request, api_stream_test, (), {})
+            self.assertEqual(list(request.api_data), data)
+            self.assertEqual(dict(request.POST), {})
+
+            # Views that don't accept a stream get the parsed array, and objects are never streamed
+            request, response = self.process(data)
+            ApiMiddleware().process_view(request, api_test, (), {})
+            self.assertEqual(request.api_data, data)
+            request, response = self.process({'name': 'x' * 32})
+            ApiMiddleware().process_view(request, api_stream_test, (), {})
+            self.assertEqual(request.api_data, {'name': 'x' * 32})
+            self.assertEqual(request.POST['name'], 'x' * 32)
+        finally:
+            ApiMiddleware._API_STREAM_JSON_SIZE = None
+
+    def test_iter_json_array(self):
+        data = [{'id': i, 'name': u'caf\xe9', 'values': [1.5, None, True]} for i in range(100)]
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.assertEqual(list(iter_json_array(io.BytesIO(body), 7)), data)
+        self.assertEqual(list(iter_json_array(io.BytesIO(b' [ ] '))), [])
+        for body in (b'{}', b'[1, 2', b'[1 2]', b''):
+            self.assertRaises(ValueError, list, iter_json_array(io.BytesIO(body), 3))
+
+    def test_content_encoding(self):
+        data = {'name': 'x' * 1000, 'customer': {'name': 'Jane'}}
+        def gzip_compress(body):
+            out = io.BytesIO()
+            with gzip.GzipFile(fileobj=out, mode='wb') as f:
+                f.write(body)
+            return out.getvalue()
+        def raw_deflate(body):
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            return compressor.compress(body) + compressor.flush()
+        for encoding, compress in (('gzip', gzip_compress), ('deflate', zlib.compress), ('deflate', raw_deflate)):
+            request, response = self.process(data, compress, HTTP_CONTENT_ENCODING=encoding)
+            self.assertIsNone(response)
+            self.assertEqual(request.api_data, data)
+            self.assertEqual(request.body, json.dumps(data))
+
+        # A chunked compressed body is decompressed too
+        request, response = self.process(data, zlib.compress, chunked=True, HTTP_CONTENT_ENCODING='deflate')
+        self.assertIsNone(response)
+        self.assertEqual(request.api_data, data)
+
+        request, response = self.process(data, lambda body: body[:10], HTTP_CONTENT_ENCODING='gzip', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        request, response = self.process(data, HTTP_CONTENT_ENCODING='br', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 415)
+
+        # Decompression bombs are stopped at the maximum size
+        ApiMiddleware._API_MAX_DECOMPRESSED_SIZE = 500
+        try:
+            request, response = self.process(data, zlib.compress, HTTP_CONTENT_ENCODING='deflate', HTTP_ACCEPT='application/json')
+        finally:
+            ApiMiddleware._API_MAX_DECOMPRESSED_SIZE = 10 * 1024 * 1024
+        self.assertEqual(response.status_code, 413)
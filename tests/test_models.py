@@ -0,0 +1,52 @@
+from django.db import models
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from symmetric.models import _clear_api_property_cache, api_property, clone_model
+
+
+class Product(models.Model):
+    price = models.IntegerField(default=0)
+    tax = models.IntegerField(default=0)
+    total = api_property('self.price + self.price * self.tax / 100')
+    cached_total = api_property('self.price + self.price * self.tax / 100', cached=True)
+
+
+class DiscountedProduct(Product):
+    discount = models.IntegerField(default=0)
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=31)
+
+
+class ApiPropertyTest(TestCase):
+
+    def test_api_property(self):
+        product = Product(price=200, tax=10)
+        self.assertEqual(product.total, 220)
+        self.assertEqual(Product.total.fget.api_code, 'self.price + self.price * self.tax / 100')
+        self.assertEqual(Product.total.fget.api_type, int)
+        product.price = 100
+        self.assertEqual(product.total, 110)
+
+    def test_cached_api_property(self):
+        product = Product(price=200, tax=10)
+        self.assertEqual(product.cached_total, 220)
+        product.price = 100
+        self.assertEqual(product.cached_total, 220)
+        product.save()
+        self.assertEqual(product.cached_total, 110)
+
+        # Subclasses are saved as themselves, and other models don't get the receiver at all
+        product = DiscountedProduct(price=200, tax=10)
+        self.assertEqual(product.cached_total, 220)
+        product.price = 100
+        product.save()
+        self.assertEqual(product.cached_total, 110)
+        self.assertFalse(_clear_api_property_cache in post_save._live_receivers(Category))
+
+    def test_clone_model(self):
+        model = clone_model(Product, 'ClonedProduct')
+        self.assertTrue(model.total.fget is Product.total.fget)
+        self.assertEqual(model(price=100, tax=5).total, 105)
@@ -0,0 +1,50 @@
+import gzip
+import io
+import json
+
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase
+
+import symmetric.response
+from symmetric.middleware import ApiMiddleware
+from symmetric.response import apply_response_headers, render_data
+
+
+def gunzip(content):
+    return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+
+
+class ApiResponseCompressionTest(TestCase):
+
+    def setUp(self):
+        setattr(symmetric.response, '__API_GZIP_MIN_SIZE', 200)
+
+    def tearDown(self):
+        setattr(symmetric.response, '__API_GZIP_MIN_SIZE', None)
+
+    def request(self, **extra):
+        request = RequestFactory().get('/api/tickets/', HTTP_ACCEPT='application/json', **extra)
+        ApiMiddleware().process_request(request)
+        return request
+
+    def test_compressed_data(self):
+        data = [{'title': 'Broken', 'status': i} for i in range(100)]
+        response = render_data(self.request(HTTP_ACCEPT_ENCODING='gzip, deflate'), data)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+        self.assertEqual(json.loads(gunzip(response.content)), data)
+
+        # Not compressed unless accepted, or below the minimum size
+        response = render_data(self.request(), data)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        response = render_data(self.request(HTTP_ACCEPT_ENCODING='gzip'), data[:1])
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_compressed_streaming(self):
+        response = StreamingHttpResponse(['{"title": "Broken"}\n'] * 50, content_type='application/json')
+        apply_response_headers(self.request(HTTP_ACCEPT_ENCODING='gzip'), response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gunzip(''.join(response.streaming_content)), '{"title": "Broken"}\n' * 50)
@@ -0,0 +1,117 @@
+import json
+
+from django.conf.urls import url
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+import symmetric.tokens
+import symmetric.views
+from symmetric.tokens import create_token, load_token, revoke_tokens
+from symmetric.views import ApiAction, ApiCurrentUserView, ApiRequirement, api_login_view, api_view
+
+
+def own_users(request, queryset):
+    return queryset.filter(id=request.user.id)
+
+
+urlpatterns = [
+    url(r'^api/login/$', api_login_view),
+    url(r'^api/me/$', ApiCurrentUserView(ApiAction.READ, ApiRequirement.LOGIN | ApiRequirement.TOKEN)),
+    url(r'^api/staff/users/$', api_view(User, ApiAction.READ, ApiRequirement.STAFF | ApiRequirement.TOKEN)),
+    url(r'^api/public/users/$', api_view(User, ApiAction.READ, ApiRequirement.ANONYMOUS_READ | ApiRequirement.TOKEN, filter=own_users)),
+]
+
+
+@override_settings(ROOT_URLCONF='tests.test_tokens')
+class ApiTokenTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        symmetric.tokens._users.clear()
+
+    def get(self, path, token):
+        return self.client.get(path, HTTP_ACCEPT='application/json', HTTP_X_API_TOKEN=token)
+
+    def test_login(self):
+        setattr(symmetric.views, '__API_TOKEN_AUTH', True)
+        try:
+            response = self.client.post('/api/login/', {'username': 'jane', 'password': 'secret'}, HTTP_ACCEPT='application/json', secure=True)
+        finally:
+            setattr(symmetric.views, '__API_TOKEN_AUTH', False)
+        self.assertEqual(response.status_code, 200)
+        token = load_token(response['X-Api-Token'])
+        self.assertEqual(token.user_id, self.user.id)
+        self.assertTrue(token.is_active)
+        self.assertFalse(token.is_staff)
+
+    def test_requirements(self):
+        token = create_token(self.user)
+        # Only the user is loaded, without a session
+        with self.assertNumQueries(1):
+            response = self.get('/api/me/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['username'], 'jane')
+        # The user is then cached in the process
+        with self.assertNumQueries(0):
+            response = self.get('/api/me/', token)
+        self.assertEqual(response.status_code, 200)
+
+        # The flags are checked without loading the user
+        with self.assertNumQueries(0):
+            response = self.get('/api/staff/users/', token)
+        self.assertEqual(response.status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.get('/api/staff/users/', create_token(self.user))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.get('/api/me/', token[:-1])
+        self.assertEqual(response.status_code, 401)
+        response = self.get('/api/staff/users/', 'bad')
+        self.assertEqual(response.status_code, 401)
+
+    def test_revoke(self):
+        token = create_token(self.user)
+        self.assertEqual(self.get('/api/me/', token).status_code, 200)
+        revoke_tokens(self.user.id)
+        self.assertEqual(self.get('/api/me/', token).status_code, 401)
+        self.assertIsNone(load_token(token))
+        token = create_token(self.user)
+        self.assertEqual(self.get('/api/me/', token).status_code, 200)
+
+        # The counter doesn't expire, so newer tokens stay valid until their own expiry
+        timeouts = []
+        set = cache.set
+        cache.set = lambda key, value, timeout=None: timeouts.append(timeout) or set(key, value, timeout)
+        try:
+            revoke_tokens(self.user.id + 1)
+        finally:
+            del cache.set
+        self.assertEqual(timeouts, [None])
+
+    def test_user_copies(self):
+        symmetric.tokens.get_token_user(self.user.id)
+        symmetric.tokens._users[self.user.id][1]._api_property_cache = {}
+        # Changes to the mutable attributes of one request's user aren't seen by the others
+        first = symmetric.tokens.get_token_user(self.user.id)
+        first._api_property_cache['name'] = 'cached'
+        first._state.adding = True
+        second = symmetric.tokens.get_token_user(self.user.id)
+        self.assertEqual(second._api_property_cache, {})
+        self.assertFalse(second._state.adding)
+
+    def test_anonymous_read(self):
+        # The token is still used on a read that doesn't require a user
+        token = create_token(self.user)
+        response = self.get('/api/public/users/', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user['username'] for user in json.loads(response.content)], ['jane'])
+        response = self.client.get('/api/public/users/', HTTP_ACCEPT='application/json')
+        self.assertEqual(json.loads(response.content), [])
+        revoke_tokens(self.user.id)
+        self.assertEqual(self.get('/api/public/users/', token).status_code, 401)
+        self.assertEqual(self.get('/api/public/users/', 'bad').status_code, 401)
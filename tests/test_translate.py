@@ -1,6 +1,9 @@
 from django.test import TestCase
 
-from symmetric.management.translate import translate_code
+from django.db.models import Case, ExpressionWrapper, FloatField
+from django.db.models.functions import Concat
+
+from symmetric.translate import translate_code, translate_expression
 
 
 class TranslateTest(TestCase):
@@ -36,3 +39,13 @@ class TranslateTest(TestCase):
         self.assertEqual(translate_code(code, 'java'), 'x.substring(1, 5)')
         self.assertEqual(translate_code(code, 'objc'), '[x substringWithRange:NSMakeRange(1, (5 - 1))]')
         self.assertEqual(translate_code(code, 'swift'), '(x as NSString).substring(with: NSMakeRange(1, (5 - 1)))')
+
+    def test_expression(self):
+        expression = translate_expression('self.price * 1.5', float)
+        self.assertTrue(isinstance(expression, ExpressionWrapper))
+        self.assertTrue(isinstance(expression.output_field, FloatField))
+        self.assertEqual(expression.expression.lhs.name, 'price')
+        self.assertTrue(isinstance(translate_expression('self.first_name + " " + self.last_name', str).expression, Concat))
+        self.assertTrue(isinstance(translate_expression('1 if self.author.age > 30 else 0').expression, Case))
+        self.assertTrue(isinstance(translate_expression('self.count != 0', bool), Case))
+        self.assertRaises(ValueError, translate_expression, 'self.name.upper()')
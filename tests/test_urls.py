@@ -0,0 +1,85 @@
+from django.conf.urls import url
+from django.core.urlresolvers import Resolver404, resolve
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+
+import symmetric.urls
+from symmetric.middleware import ApiMiddleware
+from symmetric.urls import ApiURLResolver, _literal_segments, api_patterns, api_reverse
+
+
+def view(request, **kwargs):
+    return HttpResponse()
+
+
+apipatterns = [
+    url(r'^tickets/$', view, name='tickets'),
+    url(r'^tickets/(?P<object_id>\d+)/$', view, name='ticket'),
+    url(r'^tickets/closed/$', view, name='closed_tickets'),
+    url(r'^users?/$', view, name='users'),
+    url(r'^(?P<kind>\w+)/$', view, name='kind'),
+]
+
+urlpatterns = api_patterns(('support', 'tests.test_urls', 2))
+
+
+class ApiURLResolverTest(TestCase):
+
+    def test_literal_segments(self):
+        self.assertEqual(_literal_segments(r'^tickets/(?P<object_id>\d+)/$'), ('tickets',))
+        self.assertEqual(_literal_segments(r'^api/1/tickets/$'), ('api', '1', 'tickets'))
+        self.assertEqual(_literal_segments(r'^users?/$'), ())
+        self.assertEqual(_literal_segments(r'^a/$|^b/$'), ())
+        self.assertEqual(_literal_segments(r'tickets/'), ())
+
+    def test_resolve(self):
+        match = resolve('/api/support/tickets/5/', 'tests.test_urls')
+        self.assertEqual((match.url_name, match.kwargs), ('ticket', {'object_id': '5'}))
+        self.assertEqual(resolve('/api/2/support/tickets/closed/', 'tests.test_urls').url_name, 'closed_tickets')
+        self.assertEqual(resolve('/api/support/users/', 'tests.test_urls').url_name, 'users')
+        self.assertEqual(resolve('/api/support/tickets/', 'tests.test_urls').url_name, 'tickets')
+        self.assertEqual(resolve('/api/1/support/faq/', 'tests.test_urls').kwargs, {'kind': 'faq'})
+        self.assertRaises(Resolver404, resolve, '/api/3/support/tickets/', 'tests.test_urls')
+
+    def test_candidate_patterns(self):
+        resolver = ApiURLResolver(r'^', apipatterns)
+        self.assertEqual([pattern.name for pattern in resolver.get_candidate_patterns('tickets/5/')], ['tickets', 'ticket', 'users', 'kind'])
+        self.assertEqual([pattern.name for pattern in resolver.get_candidate_patterns('tickets/closed/')], ['tickets', 'ticket', 'closed_tickets', 'users', 'kind'])
+        self.assertEqual([pattern.name for pattern in resolver.get_candidate_patterns('faq/')], ['users', 'kind'])
+        # Added patterns are found too
+        patterns = list(apipatterns)
+        resolver = ApiURLResolver(r'^', patterns)
+        self.assertEqual([pattern.name for pattern in resolver.get_candidate_patterns('faq/')], ['users', 'kind'])
+        patterns.insert(0, url(r'^faq/$', view, name='faq'))
+        self.assertEqual([pattern.name for pattern in resolver.get_candidate_patterns('faq/')], ['faq', 'users', 'kind'])
+
+    def test_api_reverse(self):
+        self.assertEqual(api_reverse('ticket', 2, 'tests.test_urls', kwargs={'object_id': 5}), '/api/2/support/tickets/5/')
+        self.assertEqual(api_reverse('tickets', urlconf='tests.test_urls'), '/api/support/tickets/')
+
+    def process(self, path):
+        request = RequestFactory().get(path, HTTP_ACCEPT='application/json')
+        middleware = ApiMiddleware()
+        middleware.process_request(request)
+        return request, middleware.process_view(request, view, (), {})
+
+    def test_strip_version(self):
+        ApiMiddleware._API_STRIP_VERSION = True
+        try:
+            with override_settings(API_STRIP_VERSION=True):
+                api_patterns(('support', 'tests.test_urls', 2), 'tests.test_urls')
+            request, response = self.process('/api/2/support/tickets/')
+            self.assertIsNone(response)
+            self.assertEqual(request.api_version, 2)
+            self.assertEqual(request.path, '/api/2/support/tickets/')
+            self.assertEqual(resolve(request.path_info, 'tests.test_urls').url_name, 'tickets')
+            self.assertIsNone(self.process('/api/support/tickets/')[1])
+
+            # Only the versions given to api_patterns are found
+            self.assertEqual(self.process('/api/3/support/tickets/')[1].status_code, 404)
+            self.assertEqual(self.process('/api/0/support/tickets/')[1].status_code, 404)
+            self.assertEqual(self.process('/api/1/tickets/')[1].status_code, 404)
+        finally:
+            ApiMiddleware._API_STRIP_VERSION = False
+            symmetric.urls._latest_versions.clear()
@@ -0,0 +1,465 @@
+import json
+
+from django.conf.urls import url
+from django.contrib.auth.models import User
+from django.db import connection, models
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+
+import symmetric.response
+from symmetric.filters import paginate_filter
+from symmetric.middleware import ApiMiddleware
+from symmetric.purge import defer_purges, flush_purges, get_purger
+from symmetric.views import ApiAction, ApiCurrentUserView, api_related_view, api_view
+
+
+class Ticket(models.Model):
+    title = models.CharField(max_length=127)
+    status = models.IntegerField(default=0)
+    views = models.IntegerField(default=0)
+    closed = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    class API:
+        last_modified_field = 'updated'
+
+
+class Device(models.Model):
+    serial = models.CharField(max_length=32, unique=True)
+    name = models.CharField(max_length=127)
+    syncs = models.IntegerField(default=0)
+
+    class API:
+        natural_key = ('serial',)
+        slug_field = 'serial'
+        validate_unique = 'database'
+
+
+class Customer(models.Model):
+    name = models.CharField(max_length=127)
+    email = models.EmailField(blank=True)
+
+
+class Order(models.Model):
+    customer = models.ForeignKey(Customer)
+    total = models.FloatField(default=0.0)
+
+    class API:
+        include_related = ('customer',)
+
+
+class Note(models.Model):
+    text = models.CharField(max_length=127)
+    edited = models.DateTimeField(null=True)
+
+    class API:
+        last_modified_field = 'edited'
+
+
+class Comment(models.Model):
+    text = models.CharField(max_length=127)
+    hidden = models.BooleanField(default=False)
+    deleted = models.BooleanField(default=False)
+
+    class API:
+        deleted_field = 'deleted'
+
+
+def open_tickets(request, queryset):
+    return queryset.filter(closed=False)
+
+
+def visible_comments(request, queryset):
+    return queryset.filter(hidden=False)
+
+
+urlpatterns = [
+    url(r'^api/notes/$', api_view(Note)),
+    url(r'^api/comments/(?P<object_id>\d+)/$', api_view(Comment, ApiAction.READ | ApiAction.UPDATE, filter=visible_comments)),
+    url(r'^api/tickets/$', api_view(Ticket, filter=paginate_filter)),
+    url(r'^api/tickets/(?P<object_id>\d+)/$', api_view(Ticket, ApiAction.READ | ApiAction.UPDATE)),
+    url(r'^api/open/tickets/(?P<object_id>\d+)/$', api_view(Ticket, ApiAction.READ | ApiAction.UPDATE | ApiAction.DELETE, filter=open_tickets)),
+    url(r'^api/pushdown/tickets/(?P<object_id>\d+)/$', api_view(Ticket, ApiAction.READ | ApiAction.UPDATE, filter=open_tickets, pushdown=True)),
+    url(r'^api/orders/(?P<object_id>\d+)/$', api_view(Order, ApiAction.READ | ApiAction.UPDATE)),
+    url(r'^api/customers/(?P<object_id>\d+)/orders/$', api_related_view(Customer, Order, 'customer', ApiAction.READ | ApiAction.CREATE, cache_control={'max_age': 60})),
+    url(r'^api/me/$', ApiCurrentUserView()),
+    url(r'^api/devices/$', api_view(Device, ApiAction.READ | ApiAction.CREATE | ApiAction.UPSERT)),
+    url(r'^api/devices/(?P<slug>[\w-]+)/$', api_view(Device, ApiAction.READ | ApiAction.UPDATE, pushdown=True)),
+    url(r'^api/shared/tickets/(?P<object_id>\d+)/$', api_view(Ticket, ApiAction.READ | ApiAction.DELETE, cors=('https://app.example.com',))),
+    url(r'^api/public/tickets/(?:(?P<object_id>\d+)/)?$', api_view(Ticket, cache_control={'public': True, 'max_age': 60, 's_maxage': 600, 'stale_while_revalidate': 30})),
+]
+
+
+@override_settings(ROOT_URLCONF='tests.test_views')
+class ApiViewTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.ticket = Ticket.objects.create(title='Broken', status=1)
+
+    def put(self, path, data):
+        return self.client.put(path, json.dumps(data), content_type='application/json', HTTP_ACCEPT='application/json')
+
+    def test_update(self):
+        response = self.put('/api/tickets/%d/' % self.ticket.id, {'status': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Ticket.objects.get(id=self.ticket.id).status, 2)
+
+    def test_pushdown_update(self):
+        updated = self.ticket.updated
+        with self.assertNumQueries(1):
+            response = self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'status': 3, 'title': 'Fixed'})
+        self.assertEqual(response.status_code, 200)
+        ticket = Ticket.objects.get(id=self.ticket.id)
+        self.assertEqual(ticket.status, 3)
+        self.assertEqual(ticket.title, 'Fixed')
+        self.assertGreaterEqual(ticket.updated, updated)
+
+        # Validation errors are reported without any query
+        with self.assertNumQueries(0):
+            response = self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'title': 'x' * 200})
+        self.assertEqual(response.status_code, 500)
+
+        # Objects that don't exist are not found
+        response = self.put('/api/pushdown/tickets/%d/' % (self.ticket.id + 1), {'status': 4})
+        self.assertEqual(response.status_code, 404)
+
+    def test_increment(self):
+        response = self.put('/api/tickets/%d/' % self.ticket.id, {'views': {'$inc': 5}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'views': 5})
+        response = self.put('/api/tickets/%d/' % self.ticket.id, {'views': {'$dec': 2}, 'status': 2})
+        self.assertEqual(json.loads(response.content), {'views': 3})
+        ticket = Ticket.objects.get(id=self.ticket.id)
+        self.assertEqual(ticket.views, 3)
+        self.assertEqual(ticket.status, 2)
+
+        # The rows are locked, updated, and the new value is selected, in a transaction that's a savepoint within the
+        # test's transaction
+        with self.assertNumQueries(5):
+            response = self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'views': {'$inc': 10}})
+        self.assertEqual(json.loads(response.content), {'views': 13})
+        # The new value is still returned when the object no longer matches the view's filter
+        response = self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'views': {'$inc': 1}, 'closed': True})
+        self.assertEqual(json.loads(response.content), {'views': 14})
+        Ticket.objects.filter(id=self.ticket.id).update(closed=False)
+
+        response = self.put('/api/tickets/%d/' % self.ticket.id, {'views': {'$mul': 2}})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Ticket.objects.get(id=self.ticket.id).views, 14)
+
+        # A new object has nothing to increment
+        response = self.client.post('/api/devices/', json.dumps({'serial': 'C3', 'name': 'Phone', 'syncs': {'$inc': 1}}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.put('/api/devices/', {'serial': 'C3', 'name': 'Phone', 'syncs': {'$inc': 1}})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Device.objects.filter(serial='C3').exists())
+
+    def test_upsert(self):
+        response = self.put('/api/devices/', {'serial': 'A1', 'name': 'Phone'})
+        self.assertEqual(response.status_code, 201)
+        device = Device.objects.get(serial='A1')
+        self.assertEqual(device.name, 'Phone')
+        self.assertEqual(response['X-New-Object-Id'], str(device.id))
+
+        response = self.put('/api/devices/', {'serial': 'A1', 'name': 'Tablet', 'syncs': {'$inc': 1}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'syncs': 1})
+        self.assertEqual(Device.objects.count(), 1)
+        self.assertEqual(Device.objects.get(serial='A1').name, 'Tablet')
+
+        response = self.put('/api/devices/', {'name': 'Laptop'})
+        self.assertEqual(response.status_code, 400)
+        response = self.put('/api/devices/', {'serial': 'B2', 'name': ''})
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Device.objects.filter(serial='B2').exists())
+
+    def test_database_validate_unique(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/devices/', json.dumps({'serial': 'C3', 'name': 'Watch'}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in context.captured_queries if 'SELECT' in query['sql']])
+
+        response = self.client.post('/api/devices/', json.dumps({'serial': 'C3', 'name': 'Watch'}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content)['message'], 'ValidationError: Device with this Serial already exists.')
+        self.assertEqual(Device.objects.filter(serial='C3').count(), 1)
+
+    def test_included_object_update(self):
+        customer = Customer.objects.create(name='Jane', email='jane@example.com')
+        order = Order.objects.create(customer=customer, total=10.0)
+
+        def updates(data):
+            with CaptureQueriesContext(connection) as context:
+                response = self.put('/api/orders/%d/' % order.id, data)
+            self.assertEqual(response.status_code, 200)
+            return [query['sql'] for query in context.captured_queries if 'UPDATE' in query['sql']]
+
+        # The unchanged customer isn't saved
+        queries = updates({'total': 12.5, 'customer': {'name': 'Jane'}})
+        self.assertEqual(len(queries), 1)
+        self.assertTrue('"tests_order"' in queries[0])
+
+        # Only the changed customer field is saved
+        queries = updates({'customer': {'name': 'Janet'}})
+        self.assertEqual(len(queries), 2)
+        self.assertTrue('"tests_customer"' in queries[0])
+        self.assertFalse('"email"' in queries[0])
+        customer = Customer.objects.get(id=customer.id)
+        self.assertEqual(customer.name, 'Janet')
+        self.assertEqual(customer.email, 'jane@example.com')
+        self.assertEqual(Order.objects.get(id=order.id).total, 12.5)
+
+    def test_filter_authorization(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/open/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['title'], 'Broken')
+
+        closed = Ticket.objects.create(title='Done', closed=True)
+        response = self.client.get('/api/open/tickets/%d/' % closed.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.put('/api/open/tickets/%d/' % closed.id, {'status': 2})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.delete('/api/open/tickets/%d/' % closed.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/open/tickets/%d/' % (closed.id + 1), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        # A deleted object is not found, even if it's also filtered out
+        hidden = Comment.objects.create(text='Spam', hidden=True)
+        deleted = Comment.objects.create(text='Spam', hidden=True, deleted=True)
+        response = self.client.get('/api/comments/%d/' % hidden.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get('/api/comments/%d/' % deleted.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+        response = self.put('/api/comments/%d/' % deleted.id, {'text': 'Ham'})
+        self.assertEqual(response.status_code, 404)
+
+        # The pushdown update also reports unauthorized objects
+        response = self.put('/api/pushdown/tickets/%d/' % closed.id, {'status': 2})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Ticket.objects.get(id=closed.id).status, 0)
+
+    def test_related_view(self):
+        customer = Customer.objects.create(name='Jane')
+        Order.objects.create(customer=customer, total=10.0)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/customers/%d/orders/' % customer.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), 1)
+
+        response = self.client.post('/api/customers/%d/orders/' % customer.id, json.dumps({'total': 5.0}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.filter(customer=customer).count(), 2)
+        response = self.client.post('/api/customers/%d/orders/' % (customer.id + 1), json.dumps({'total': 5.0}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_identity_map(self):
+        User.objects.create_user('jane', 'jane@example.com', 'secret')
+        self.assertTrue(self.client.login(username='jane', password='secret'))
+        # Only the session and the user are queried, the user isn't fetched again
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/me/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['username'], 'jane')
+
+    def test_validate_before_fetch(self):
+        with self.assertNumQueries(0):
+            response = self.put('/api/tickets/%d/' % self.ticket.id, {'title': 'x' * 200})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content)['message'], 'ValidationError: Ensure this value has at most 127 characters (it has 200).')
+        with self.assertNumQueries(0):
+            response = self.put('/api/tickets/%d/' % self.ticket.id, {'title': ''})
+        self.assertEqual(json.loads(response.content)['message'], 'ValidationError: This field cannot be blank.')
+
+        customer = Customer.objects.create(name='Jane')
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/customers/%d/orders/' % customer.id, json.dumps({'total': 'x'}), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 500)
+        response = self.put('/api/orders/%d/' % Order.objects.create(customer=customer).id, {'customer': {'email': 'jane'}})
+        self.assertEqual(json.loads(response.content)['message'], 'ValidationError: Enter a valid email address.')
+
+    def test_cors(self):
+        path = '/api/shared/tickets/%d/' % self.ticket.id
+        with self.assertNumQueries(0):
+            response = self.client.options(path, HTTP_ORIGIN='https://app.example.com', HTTP_ACCESS_CONTROL_REQUEST_METHOD='DELETE')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example.com')
+        self.assertEqual(response['Access-Control-Allow-Methods'], 'GET, HEAD, DELETE')
+        self.assertEqual(response['Access-Control-Max-Age'], '86400')
+        self.assertEqual(response['Vary'], 'Origin')
+
+        response = self.client.get(path, HTTP_ORIGIN='https://app.example.com', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example.com')
+        self.assertTrue('Origin' in response['Vary'])
+
+        # Other origins aren't allowed
+        response = self.client.options(path, HTTP_ORIGIN='https://evil.example.com', HTTP_ACCESS_CONTROL_REQUEST_METHOD='DELETE')
+        self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+        response = self.client.get(path, HTTP_ORIGIN='https://evil.example.com', HTTP_ACCEPT='application/json')
+        self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+
+        # Views without their own setting use the global one
+        response = self.client.get('/api/tickets/%d/' % self.ticket.id, HTTP_ORIGIN='https://app.example.com', HTTP_ACCEPT='application/json')
+        self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+        ApiMiddleware._API_CORS_ORIGINS = '*'
+        try:
+            response = self.client.options('/api/devices/', HTTP_ORIGIN='https://app.example.com', HTTP_ACCESS_CONTROL_REQUEST_METHOD='PUT')
+            self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+            self.assertEqual(response['Access-Control-Allow-Methods'], 'GET, HEAD, POST, PUT, PATCH')
+            response = self.put('/api/devices/', {'serial': 'D4', 'name': 'Phone'})
+            self.assertFalse(response.has_header('Access-Control-Allow-Origin'))
+            response = self.client.put('/api/devices/', json.dumps({'serial': 'E5', 'name': 'Phone'}), content_type='application/json', HTTP_ACCEPT='application/json', HTTP_ORIGIN='https://app.example.com')
+            self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+            self.assertEqual(response['Access-Control-Expose-Headers'], 'X-New-Object-Id')
+        finally:
+            ApiMiddleware._API_CORS_ORIGINS = None
+
+    def test_cors_credentials(self):
+        ApiMiddleware._API_CORS_CREDENTIALS = True
+        setattr(symmetric.response, '__API_CORS_CREDENTIALS', True)
+        ApiMiddleware._API_CORS_ORIGINS = '*'
+        try:
+            # Any origin never gets credentials
+            response = self.client.options('/api/devices/', HTTP_ORIGIN='https://evil.example.com', HTTP_ACCESS_CONTROL_REQUEST_METHOD='GET')
+            self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+            self.assertFalse(response.has_header('Access-Control-Allow-Credentials'))
+            response = self.client.get('/api/devices/', HTTP_ORIGIN='https://evil.example.com', HTTP_ACCEPT='application/json')
+            self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+            self.assertFalse(response.has_header('Access-Control-Allow-Credentials'))
+            # A listed origin does
+            response = self.client.get('/api/shared/tickets/%d/' % self.ticket.id, HTTP_ORIGIN='https://app.example.com', HTTP_ACCEPT='application/json')
+            self.assertEqual(response['Access-Control-Allow-Origin'], 'https://app.example.com')
+            self.assertEqual(response['Access-Control-Allow-Credentials'], 'true')
+        finally:
+            ApiMiddleware._API_CORS_CREDENTIALS = False
+            setattr(symmetric.response, '__API_CORS_CREDENTIALS', False)
+            ApiMiddleware._API_CORS_ORIGINS = None
+
+    def test_head(self):
+        Ticket.objects.create(title='Slow', status=1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.head('/api/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, '')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertFalse('"title"' in context.captured_queries[0]['sql'])
+        self.assertEqual(response['Last-Modified'], self.client.get('/api/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')['Last-Modified'])
+
+        response = self.client.head('/api/tickets/%d/' % (self.ticket.id + 10), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+        closed = Ticket.objects.create(title='Done', closed=True)
+        response = self.client.head('/api/open/tickets/%d/' % closed.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        # Only the count and the last modified date are queried for a collection
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.head('/api/tickets/?pagesize=2', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Total'], '3')
+        self.assertEqual(response['X-Total-Pages'], '2')
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertFalse([query for query in context.captured_queries if '"title"' in query['sql']])
+        response = self.client.get('/api/tickets/?pagesize=2', HTTP_ACCEPT='application/json')
+        self.assertEqual(len(json.loads(response.content)), 2)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_cache_control(self):
+        response = self.client.get('/api/public/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response['Cache-Control'].split(', ')), ['max-age=60', 'public', 's-maxage=600', 'stale-while-revalidate=30'])
+        self.assertEqual(response['Vary'], 'Accept, X-Requested-With')
+        response = self.client.head('/api/public/tickets/', HTTP_ACCEPT='application/json')
+        self.assertTrue('public' in response['Cache-Control'])
+
+        # Errors and writes are never cached
+        response = self.client.get('/api/public/tickets/%d/' % (self.ticket.id + 1), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue('no-store' in response['Cache-Control'])
+        response = self.client.post('/api/public/tickets/', '{}', content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 405)
+        self.assertTrue('no-store' in response['Cache-Control'])
+        response = self.client.get('/api/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertTrue('no-store' in response['Cache-Control'])
+        # JSONP errors have a 200 status
+        ApiMiddleware._API_JSONP = True
+        try:
+            response = self.client.get('/api/public/tickets/%d/?callback=done' % (self.ticket.id + 1))
+        finally:
+            ApiMiddleware._API_JSONP = False
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith('done({"code":404'))
+        self.assertTrue('no-store' in response['Cache-Control'])
+
+    @override_settings(API_PURGER='symmetric.purge.MemoryPurger')
+    def test_surrogate_keys(self):
+        response = self.client.get('/api/public/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Surrogate-Key'], 'tests.ticket.%d' % self.ticket.id)
+        response = self.client.head('/api/public/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Cache-Tag'], 'tests.ticket.%d' % self.ticket.id)
+        response = self.client.get('/api/public/tickets/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Surrogate-Key'], 'tests.ticket')
+        customer = Customer.objects.create(name='Jane')
+        response = self.client.get('/api/customers/%d/orders/' % customer.id, HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Surrogate-Key'], 'tests.customer.%d tests.order' % customer.id)
+        self.assertEqual(response['Cache-Tag'], 'tests.customer.%d,tests.order' % customer.id)
+        # Responses that aren't cached aren't tagged
+        response = self.client.get('/api/tickets/%d/' % self.ticket.id, HTTP_ACCEPT='application/json')
+        self.assertFalse(response.has_header('Surrogate-Key'))
+
+        purged = get_purger().purged
+        del purged[:]
+        self.put('/api/tickets/%d/' % self.ticket.id, {'status': 2})
+        self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'status': 3})
+        order = Order.objects.create(customer=customer)
+        order_id = order.id
+        order.delete()
+        self.assertEqual(purged, [
+            ['tests.ticket', 'tests.ticket.%d' % self.ticket.id],
+            ['tests.ticket', 'tests.ticket.%d' % self.ticket.id],
+            ['tests.order', 'tests.order.%d' % order_id],
+            ['tests.order', 'tests.order.%d' % order_id],
+        ])
+
+        # An object updated by slug is purged by id
+        device = Device.objects.create(serial='F7', name='Phone')
+        del purged[:]
+        response = self.put('/api/devices/F7/', {'name': 'Tablet'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Device.objects.get(id=device.id).name, 'Tablet')
+        self.assertEqual(purged, [['tests.device', 'tests.device.%d' % device.id]])
+
+        # The keys purged during a request are only purged once it has finished
+        del purged[:]
+        defer_purges()
+        self.ticket.save()
+        self.ticket.save()
+        self.assertEqual(purged, [])
+        flush_purges()
+        self.assertEqual(purged, [['tests.ticket', 'tests.ticket.%d' % self.ticket.id]])
+
+    def test_large_json_object(self):
+        ApiMiddleware._API_STREAM_JSON_SIZE = 16
+        try:
+            response = self.put('/api/pushdown/tickets/%d/' % self.ticket.id, {'status': 3, 'title': 'x' * 100})
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post('/api/devices/', json.dumps({'serial': 'F6', 'name': 'x' * 100}), content_type='application/json', HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 201)
+        finally:
+            ApiMiddleware._API_STREAM_JSON_SIZE = None
+        self.assertEqual(Ticket.objects.get(id=self.ticket.id).title, 'x' * 100)
+
+    def test_null_last_modified(self):
+        Note.objects.create(text='Draft')
+        response = self.client.get('/api/notes/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        Note.objects.create(text='Final', edited=self.ticket.updated)
+        response = self.client.get('/api/notes/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], self.client.head('/api/notes/', HTTP_ACCEPT='application/json')['Last-Modified'])
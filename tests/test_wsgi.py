@@ -0,0 +1,46 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from symmetric.wsgi import _DEFAULT_API_MIDDLEWARE_CLASSES, get_api_wsgi_application
+from tests.test_views import Ticket
+
+
+@override_settings(ROOT_URLCONF='tests.test_views', API_MIDDLEWARE_CLASSES=('symmetric.middleware.ApiMiddleware',))
+class ApiWSGIApplicationTest(TestCase):
+
+    def request(self, application, path, **extra):
+        environ = RequestFactory()._base_environ(PATH_INFO=path, REQUEST_METHOD='GET', HTTP_ACCEPT='application/json', **extra)
+        status = []
+        content = ''.join(application(environ, lambda s, headers: status.append(s)))
+        return int(status[0].split()[0]), content
+
+    def test_api_handler(self):
+        ticket = Ticket.objects.create(title='Broken')
+        application = get_api_wsgi_application()
+        status, content = self.request(application, '/api/tickets/%d/' % ticket.id)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content)['title'], 'Broken')
+        self.assertEqual(len(application.api_handler._request_middleware), 1)
+        # Other requests go through all of the middleware
+        status, content = self.request(application, '/tickets/')
+        self.assertEqual(status, 404)
+        self.assertTrue(len(application.handler._request_middleware) > 1)
+
+    def test_stale_session(self):
+        user = User.objects.create_user('jane', 'jane@example.com', 'secret')
+        client = Client()
+        self.assertTrue(client.login(username='jane', password='secret'))
+        cookie = 'sessionid=%s' % client.cookies['sessionid'].value
+        with self.settings(API_MIDDLEWARE_CLASSES=_DEFAULT_API_MIDDLEWARE_CLASSES):
+            application = get_api_wsgi_application()
+            status, content = self.request(application, '/api/me/', HTTP_COOKIE=cookie)
+            self.assertEqual(status, 200)
+            # Changing the password invalidates the session
+            user.set_password('changed')
+            user.save()
+            status, content = self.request(application, '/api/me/', HTTP_COOKIE=cookie)
+            self.assertEqual(status, 401)